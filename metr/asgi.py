@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'metr.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported once django is set up by get_asgi_application
+from telemetry.asgi import TelemetryIngestApplication  # noqa: E402
+
+application = TelemetryIngestApplication(django_application)
@@ -53,6 +53,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'telemetry.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -169,14 +170,8 @@ LOGGING = {
     }
 }
 
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
-        "CONFIG": {
-            "hosts": [os.environ.get('REDIS_URL')],
-        },
-    },
-}
+# render and parse JSON with orjson (telemetry.renderers.ORJSONRenderer, telemetry.parsers.ORJSONParser)
+TELEMETRY_ORJSON = os.environ.get('TELEMETRY_ORJSON', '').lower() in ('1', 'true')
 
 REST_FRAMEWORK = {
     # 'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
@@ -184,11 +179,53 @@ REST_FRAMEWORK = {
     'DEFAULT_VERSIONING_CLASS': 'rest_framework.versioning.URLPathVersioning',
     'DEFAULT_VERSION': 'v1',
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'telemetry.renderers.ORJSONRenderer' if TELEMETRY_ORJSON else 'rest_framework.renderers.JSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
         'rest_framework_csv.renderers.CSVRenderer',
     ],
+    'DEFAULT_PARSER_CLASSES': [
+        'telemetry.parsers.ORJSONParser' if TELEMETRY_ORJSON else 'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
     ),
 }
+
+# Telemetry
+
+# number of devices kept in the in-process cache used to resolve devices when ingesting messages
+TELEMETRY_DEVICE_CACHE_SIZE = int(os.environ.get('TELEMETRY_DEVICE_CACHE_SIZE', 10000))
+# alias of a cache from CACHES used to share the cached devices between processes, in-process only if not set
+TELEMETRY_DEVICE_CACHE_ALIAS = os.environ.get('TELEMETRY_DEVICE_CACHE_ALIAS')
+# alias of the cache from CACHES holding the latest telemetry CSV exports, which must be shared between the
+# processes serving the exports and the ones ingesting messages (memcached, redis, database or file based cache),
+# and seconds an export is kept. the exports are not cached nor tagged when it is a local memory cache, as the
+# default cache is when CACHES is not configured
+TELEMETRY_EXPORT_CACHE_ALIAS = os.environ.get('TELEMETRY_EXPORT_CACHE_ALIAS', 'default')
+TELEMETRY_EXPORT_CACHE_TIMEOUT = int(os.environ.get('TELEMETRY_EXPORT_CACHE_TIMEOUT', 3600))
+# seconds the watermark of the incremental exports lags behind, which must be longer than an ingest transaction
+TELEMETRY_EXPORT_WATERMARK_LAG = int(os.environ.get('TELEMETRY_EXPORT_WATERMARK_LAG', 60))
+
+# store the values of every new message packed in the message row, their dimensions interned in the Dimension
+# table, instead of as a Value row per value. messages stored in either mode are read the same way
+TELEMETRY_PACKED_VALUES = os.environ.get('TELEMETRY_PACKED_VALUES', '').lower() in ('1', 'true')
+
+# journal validated payloads in the ingest queue and answer 202, the messages being created by the
+# process_ingest_queue workers, instead of creating them while the gateway waits
+TELEMETRY_ASYNC_INGEST = os.environ.get('TELEMETRY_ASYNC_INGEST', '').lower() in ('1', 'true')
+# number of pending payloads above which new payloads are refused with 503, unbounded if not set
+TELEMETRY_INGEST_QUEUE_MAX_PENDING = int(os.environ['TELEMETRY_INGEST_QUEUE_MAX_PENDING']) \
+    if os.environ.get('TELEMETRY_INGEST_QUEUE_MAX_PENDING') else None
+
+# asynchronous ingestion endpoint served over ASGI (telemetry.asgi.TelemetryIngestApplication):
+# number of threads writing to the database, payloads written per batch, seconds a batch waits to fill up
+# and number of payloads waiting to be written before requests wait for room
+TELEMETRY_ASGI_WRITER_THREADS = int(os.environ.get('TELEMETRY_ASGI_WRITER_THREADS', 4))
+TELEMETRY_ASGI_BATCH_SIZE = int(os.environ.get('TELEMETRY_ASGI_BATCH_SIZE', 200))
+TELEMETRY_ASGI_BATCH_DELAY = float(os.environ.get('TELEMETRY_ASGI_BATCH_DELAY', 0.05))
+TELEMETRY_ASGI_MAX_PENDING = int(os.environ.get('TELEMETRY_ASGI_MAX_PENDING', 10000))
+
+# days soft deleted devices, messages and values are kept before the purge_deleted command removes them
+TELEMETRY_PURGE_RETENTION_DAYS = int(os.environ.get('TELEMETRY_PURGE_RETENTION_DAYS', 30))
@@ -19,8 +19,11 @@ from django.urls import path, include
 from rest_framework.schemas import get_schema_view
 from django.views.generic import TemplateView
 
+from telemetry.views import metrics
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics, name='metrics'),
     path('<version>/', include('telemetry.urls')),
     path('openapi', get_schema_view(
         title="Metr API",
@@ -1,29 +1,291 @@
+import base64
+import binascii
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django_filters import rest_framework as filters
-from rest_framework import mixins, viewsets
-from rest_framework_csv.renderers import CSVRenderer
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
+from rest_framework_csv.renderers import CSVRenderer, CSVStreamingRenderer
 
-from telemetry.models import Message, Device
-from telemetry.serializers import DeviceTelemetrySerializer, DeviceLatestTelemetryCVSSerializer
+from telemetry.cache import export_cache
+from telemetry.filters import DailyConsumptionFilter, MessageFilter, MonthlyConsumptionFilter
+from telemetry.middleware import SerializeTimeMixin
+from telemetry.models import Message, Device, QueuedMessage, DailyConsumption, MonthlyConsumption, get_ingest_key
+from telemetry.pagination import MessageCursorPagination
+from telemetry.serializers import ConsumptionSerializer, DeviceTelemetrySerializer, DeviceLatestTelemetryCVSSerializer
 
 
-class DeviceTelemetryViewSet(mixins.CreateModelMixin, mixins.ListModelMixin,
+class DeviceTelemetryViewSet(SerializeTimeMixin, mixins.CreateModelMixin, mixins.ListModelMixin,
                              viewsets.GenericViewSet):
     """
     Device Telemetry
-        - Lists all messages sent to the backend for any device
+        - Lists the messages sent to the backend, most recent first, a page at a time, filtered by device
+          `identnr` and by time range with `created_after` and `created_before`
         - Creates messages to be sent to the backend from the gateway's payload for various devices and their telemetry
+        - Creates many messages at once from a batch of gateway payloads
+        - Stores the retransmissions of a message once, identified by their content or by an `Idempotency-Key`
+          header, answering them with 200 and the message stored for the first transmission
+        - When TELEMETRY_ASYNC_INGEST is enabled, validated payloads are journaled in the ingest queue and
+          accepted with 202, the messages being created by the process_ingest_queue workers. the retransmissions
+          are then deduplicated when they are stored, by their content or by their `Idempotency-Key` header,
+          and only answered with 200 and the stored message once it has been stored
     """
-    queryset = Message.objects.all()
+    # the devices of a page of messages are joined in and their values are read by the list serializer
+    # with a single query, so that a page is fetched with a fixed number of queries. the messages of soft
+    # deleted devices are left out along with the soft deleted messages
+    queryset = Message.objects.filter(device__is_deleted=False).select_related('device')
     serializer_class = DeviceTelemetrySerializer
+    pagination_class = MessageCursorPagination
+    filterset_class = MessageFilter
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        if not settings.TELEMETRY_ASYNC_INGEST:
+            message = serializer.save(idempotency_key=request.headers.get('Idempotency-Key'))
+            # a retransmission gets back the message stored for its first transmission
+            status_code = status.HTTP_200_OK if getattr(message, 'duplicate', False) else status.HTTP_201_CREATED
+            return Response(serializer.data, status=status_code, headers=self.get_success_headers(serializer.data))
+
+        queue_full = self.queue_full_response()
+        if queue_full is not None:
+            return queue_full
+
+        idempotency_key = request.headers.get('Idempotency-Key')
+        data = serializer.validated_data
+        ingest_key = get_ingest_key(data['device']['identnr'], data['data'], idempotency_key)
+        message = Message.all_objects.select_related('device').filter(ingest_key=ingest_key).first()
+        if message is not None:
+            # the retransmission of a message which has already been stored is not queued
+            return Response(self.get_serializer(message).data, status=status.HTTP_200_OK)
+
+        queued = QueuedMessage.objects.create(payload=request.data, idempotency_key=idempotency_key)
+        return Response({'uuid': queued.uuid}, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'])
+    def queue(self, request, *args, **kwargs):
+        """queue
+            returns the backpressure metrics of the ingest queue
+        """
+        return Response(QueuedMessage.stats())
+
+    def queue_full_response(self, incoming=1):
+        """returns a 503 response asking the gateway to retry later when the [incoming] payloads would fill the
+        ingest queue past its limit"""
+        max_pending = settings.TELEMETRY_INGEST_QUEUE_MAX_PENDING
+        if max_pending is None:
+            return None
+
+        pending = QueuedMessage.objects.filter(status=QueuedMessage.PENDING).order_by()[:max_pending].count()
+        if pending + incoming <= max_pending:
+            return None
 
+        return Response({'detail': 'The ingest queue is full, retry later.'},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '30'})
 
-class LatestTelemetryCVSViewSet( mixins.ListModelMixin, viewsets.GenericViewSet):
+    @action(detail=False, methods=['post'])
+    def batch(self, request, *args, **kwargs):
+        """batch
+            accepts a list of gateway payloads (possibly for many devices), validates each of them and
+            creates all the valid ones at once. the response reports a status for every item in the order received.
+            in the asynchronous ingest mode, the retransmissions of stored messages are answered with 200 without
+            being queued, and the whole batch is refused when it does not fit in the ingest queue.
+        """
+        if not isinstance(request.data, list):
+            return Response({'detail': 'Expected a list of messages.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = []
+        valid_data = []
+        for item in request.data:
+            serializer = self.get_serializer(data=item)
+            if serializer.is_valid():
+                valid_data.append(serializer.validated_data)
+                results.append({'status': status.HTTP_201_CREATED})
+            else:
+                results.append({'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors})
+
+        if settings.TELEMETRY_ASYNC_INGEST:
+            # the retransmissions of messages which have already been stored are not queued
+            keys = [get_ingest_key(data['device']['identnr'], data['data']) for data in valid_data]
+            originals = {message.ingest_key: message
+                         for message in Message.all_objects.filter(ingest_key__in=set(keys))}
+            for message in originals.values():
+                message.duplicate = True
+            payloads = [item for item, result in zip(request.data, results)
+                        if result['status'] == status.HTTP_201_CREATED]
+            payloads = [item for item, key in zip(payloads, keys) if key not in originals]
+
+            queue_full = self.queue_full_response(incoming=len(payloads))
+            if queue_full is not None:
+                return queue_full
+
+            queued = iter(QueuedMessage.objects.bulk_create([QueuedMessage(payload=item) for item in payloads]))
+            messages = iter([originals[key] if key in originals else next(queued) for key in keys])
+            success_status = status.HTTP_202_ACCEPTED
+        else:
+            messages = iter(self.get_serializer(many=True).create(valid_data))
+            success_status = status.HTTP_201_CREATED
+
+        for result in results:
+            if result['status'] == status.HTTP_201_CREATED:
+                message = next(messages)
+                result['status'] = status.HTTP_200_OK if getattr(message, 'duplicate', False) else success_status
+                result['uuid'] = message.uuid
+
+        succeeded_all = len(valid_data) == len(results)
+        return Response(results, status=success_status if succeeded_all else status.HTTP_207_MULTI_STATUS)
+
+
+class LatestTelemetryCVSViewSet(SerializeTimeMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
     """
     LatestTelemetryCVS
         - returns the latest telemetry message CSV for a particular device or all devices
+        - streams the CSV row by row when requested with `?stream=true`, reading the devices in chunks
+          through a server side cursor so memory stays constant whatever the number of devices
+        - tags every export with an ETag, answering 304 to a matching `If-None-Match`, and serves repeated
+          exports from the export cache until a message is ingested for one of their devices, when the export
+          cache is shared between processes (TELEMETRY_EXPORT_CACHE_ALIAS)
+        - returns every export with a watermark in the `X-Watermark` header. passing it back as `cursor`,
+          or passing a timestamp as `changed_since`, only exports the devices whose latest telemetry changed
+          after it. the watermark lags by TELEMETRY_EXPORT_WATERMARK_LAG seconds so that changes committed
+          late are not missed, devices changed within that lag being exported again by the next poll
     """
-    queryset = Device.objects.all()
+    # only devices which have sent a message have a latest telemetry, which is joined in so that
+    # the whole export is produced by a single query whatever the number of devices. a latest telemetry which
+    # is soft deleted, or whose message is, is left out
+    queryset = Device.objects.filter(latest_telemetry__is_deleted=False, latest_telemetry__message__is_deleted=False) \
+        .select_related('latest_telemetry')
     serializer_class = DeviceLatestTelemetryCVSSerializer
     renderer_classes = [CSVRenderer]
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_fields = ('identnr',)
+    # number of devices fetched from the database cursor at a time when streaming
+    stream_chunk_size = 2000
+
+    def list(self, request, *args, **kwargs):
+        watermark = self.get_watermark(request)
+        if watermark is not None or not export_cache.enabled:
+            # the incremental exports depend on the time they are made at and are never cached
+            response = self.stream(request) if self.streamed(request) else super().list(request, *args, **kwargs)
+            self.set_watermark(response, watermark)
+            return response
+
+        tag = export_cache.get_tag(request.query_params)
+        etag = quote_etag(tag)
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+        if self.streamed(request):
+            response = self.stream(request)
+        else:
+            cached = export_cache.get(tag)
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+            else:
+                response = super().list(request, *args, **kwargs)
+                if response.status_code == status.HTTP_200_OK:
+                    response.add_post_render_callback(
+                        # an empty export is rendered without any content type
+                        lambda rendered: export_cache.set(tag, rendered.content, rendered.get('Content-Type'))
+                    )
+
+        response['ETag'] = etag
+        self.set_watermark(response)
+        return response
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        watermark = self.get_watermark(self.request)
+        if watermark is not None:
+            queryset = queryset.filter(latest_telemetry__updated_at__gt=watermark)
+        return queryset
+
+    @staticmethod
+    def streamed(request):
+        return request.query_params.get('stream', '').lower() in ('1', 'true')
+
+    @staticmethod
+    def get_watermark(request):
+        """:return datetime: the watermark passed as `cursor` or `changed_since`, or None for a full export"""
+        cursor = request.query_params.get('cursor')
+        changed_since = request.query_params.get('changed_since')
+        if cursor is not None:
+            try:
+                changed_since = base64.urlsafe_b64decode(cursor.encode()).decode()
+            except (binascii.Error, UnicodeDecodeError):
+                raise ValidationError({'cursor': 'Invalid cursor.'})
+        if changed_since is None:
+            return None
+
+        try:
+            watermark = parse_datetime(changed_since)
+        except ValueError:
+            watermark = None
+        if watermark is None:
+            raise ValidationError({'cursor' if cursor is not None else 'changed_since': 'Invalid timestamp.'})
+        if timezone.is_naive(watermark):
+            watermark = timezone.make_aware(watermark, timezone.utc)
+        return watermark
+
+    @staticmethod
+    def set_watermark(response, previous=None):
+        """sets the watermark to pass as `cursor` to only export what changes after the [response]"""
+        watermark = timezone.now() - timedelta(seconds=settings.TELEMETRY_EXPORT_WATERMARK_LAG)
+        if previous is not None:
+            watermark = max(watermark, previous)
+        response['X-Watermark'] = base64.urlsafe_b64encode(watermark.isoformat().encode()).decode()
+
+    def stream(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = self.get_serializer()
+        rows = (serializer.to_representation(device) for device in queryset.iterator(chunk_size=self.stream_chunk_size))
+
+        # same columns in the same order as the CSVRenderer produces for the non streamed response
+        renderer_context = {'header': sorted(serializer.Meta.fields)}
+        return StreamingHttpResponse(CSVStreamingRenderer().render(rows, renderer_context=renderer_context),
+                                     content_type=CSVStreamingRenderer.media_type)
+
+
+class ConsumptionHistoryViewSet(SerializeTimeMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    Consumption History
+        - returns the daily consumption history of a device given by its `identnr`, or its monthly history with
+          `period=month`, optionally between the `start` and `end` days
+        - reads the rollups maintained at ingest, a row per day or month whatever the number of readings
+    """
+    queryset = DailyConsumption.objects.all()
+    serializer_class = ConsumptionSerializer
+    # rollup and filter of every period
+    rollups = {
+        'day': (DailyConsumption, DailyConsumptionFilter),
+        'month': (MonthlyConsumption, MonthlyConsumptionFilter),
+    }
+
+    @property
+    def rollup(self):
+        # the schema generation inspects the view without a request
+        request = getattr(self, 'request', None)
+        period = request.query_params.get('period', 'day') if request is not None else 'day'
+        if period not in self.rollups:
+            raise ValidationError({'period': f'Expected one of {", ".join(self.rollups)}.'})
+        return self.rollups[period]
+
+    @property
+    def filterset_class(self):
+        model, filterset_class = self.rollup
+        return filterset_class
+
+    def get_queryset(self):
+        model, filterset_class = self.rollup
+        return model.objects.filter(device__is_deleted=False).order_by('period')
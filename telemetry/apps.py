@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class TelemetryConfig(AppConfig):
     name = 'telemetry'
+
+    def ready(self):
+        import telemetry.signals  # noqa: F401
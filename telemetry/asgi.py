@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from telemetry.models import QueuedMessage
+from telemetry.serializers import DeviceTelemetrySerializer, create_telemetry_messages
+
+logger = logging.getLogger('api')
+
+
+class BatchWriter:
+    """BatchWriter
+        collects the validated payloads of concurrent requests and stores them in batches from a bounded pool
+        of threads, so that the event loop never waits on the database.
+        - a batch is written once [batch_size] payloads are waiting or [batch_delay] seconds after its first one
+        - at most [max_pending] payloads wait to be written, requests waiting for room beyond that
+        - a batch which cannot be stored is stored payload by payload, so that only the requests whose payload
+          cannot be stored fail
+    """
+
+    def __init__(self, threads, batch_size, batch_delay, max_pending):
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.loop = asyncio.get_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='telemetry-writer')
+        self.pending = asyncio.Queue(maxsize=max_pending)
+        self.workers = [asyncio.ensure_future(self.run()) for _ in range(threads)]
+
+    async def submit(self, validated_data):
+        """:return tuple(uuid, duplicate): uuid of the created message, or of the queued payload in the async
+        ingest mode, and whether the message is the retransmission of a stored message
+        """
+        future = asyncio.get_event_loop().create_future()
+        await self.pending.put((validated_data, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self.pending.get()]
+            deadline = loop.time() + self.batch_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.pending.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                results = await loop.run_in_executor(self.executor, self.write, [data for data, future in batch])
+            except Exception as error:
+                logger.exception('Storing a batch of asynchronously received messages failed')
+                for data, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+            else:
+                for (data, future), result in zip(batch, results):
+                    if future.done():
+                        continue
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+
+    @classmethod
+    def write(cls, validated_data_list):
+        """:return list: for every payload tuple(uuid, duplicate), or the exception which prevented storing it"""
+        close_old_connections()
+        try:
+            try:
+                with transaction.atomic():
+                    stored = cls.store(validated_data_list)
+                return [(str(instance.uuid), getattr(instance, 'duplicate', False)) for instance in stored]
+            except Exception:
+                logger.exception('Storing a batch of asynchronously received messages failed, '
+                                 'storing its payloads one by one')
+
+            results = []
+            for validated_data in validated_data_list:
+                try:
+                    with transaction.atomic():
+                        instance, = cls.store([validated_data])
+                    results.append((str(instance.uuid), getattr(instance, 'duplicate', False)))
+                except Exception as error:
+                    logger.exception('Storing an asynchronously received message failed')
+                    results.append(error)
+            return results
+        finally:
+            close_old_connections()
+
+    @staticmethod
+    def store(validated_data_list):
+        """:return list: the queued payloads in the async ingest mode, or else the created messages"""
+        if settings.TELEMETRY_ASYNC_INGEST:
+            return QueuedMessage.objects.bulk_create(
+                [QueuedMessage(payload=data['payload'], idempotency_key=data['validated_data'].get('idempotency_key'))
+                 for data in validated_data_list]
+            )
+        return create_telemetry_messages([data['validated_data'] for data in validated_data_list])
+
+
+class TelemetryIngestApplication:
+    """TelemetryIngestApplication
+        ASGI application receiving gateway payloads without blocking the event loop, so that a process can hold
+        thousands of slow gateway connections. POST requests to /<version>/api/device_message/async/ are parsed
+        and validated in the event loop and their writes are batched by a BatchWriter, every other request is
+        passed on to the django [application].
+    """
+
+    path = re.compile(r'^/[^/]+/api/device_message/async/?$')
+
+    def __init__(self, application):
+        self.application = application
+        self.writer = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and self.path.match(scope['path']):
+            await self.ingest(scope, receive, send)
+        else:
+            await self.application(scope, receive, send)
+
+    async def ingest(self, scope, receive, send):
+        if scope['method'] != 'POST':
+            return await self.respond(send, 405, {'detail': f'Method "{scope["method"]}" not allowed.'})
+
+        body = await self.read_body(receive)
+        if body is None:
+            return await self.respond(send, 413, {'detail': 'Request body too large.'})
+
+        try:
+            payload = json.loads(body)
+        except ValueError as error:
+            return await self.respond(send, 400, {'detail': f'JSON parse error - {error}'})
+
+        serializer = DeviceTelemetrySerializer(data=payload)
+        if not serializer.is_valid():
+            return await self.respond(send, 400, serializer.errors)
+
+        if self.writer is None or self.writer.loop is not asyncio.get_event_loop():
+            if self.writer is not None:
+                self.writer.executor.shutdown(wait=False)
+            self.writer = BatchWriter(settings.TELEMETRY_ASGI_WRITER_THREADS, settings.TELEMETRY_ASGI_BATCH_SIZE,
+                                      settings.TELEMETRY_ASGI_BATCH_DELAY, settings.TELEMETRY_ASGI_MAX_PENDING)
+        validated_data = serializer.validated_data
+        headers = dict(scope.get('headers', []))
+        if b'idempotency-key' in headers:
+            validated_data = {**validated_data, 'idempotency_key': headers[b'idempotency-key'].decode('latin-1')}
+        try:
+            uuid, duplicate = await self.writer.submit({'payload': payload, 'validated_data': validated_data})
+        except Exception:
+            return await self.respond(send, 500, {'detail': 'The message could not be stored.'})
+
+        if duplicate:
+            return await self.respond(send, 200, {'uuid': uuid})
+        await self.respond(send, 202 if settings.TELEMETRY_ASYNC_INGEST else 201, {'uuid': uuid})
+
+    @staticmethod
+    async def read_body(receive):
+        """:return bytes: the request body, or None if it is larger than DATA_UPLOAD_MAX_MEMORY_SIZE"""
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            body.extend(message.get('body', b''))
+            if settings.DATA_UPLOAD_MAX_MEMORY_SIZE is not None and len(body) > settings.DATA_UPLOAD_MAX_MEMORY_SIZE:
+                return None
+            if not message.get('more_body', False):
+                break
+        return bytes(body)
+
+    @staticmethod
+    async def respond(send, status, data):
+        body = json.dumps(data, default=str).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,172 @@
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+
+class DeviceCache:
+    """DeviceCache
+        bounded least recently used cache of the devices by [identnr] used on the ingest path, so that messages
+        of known devices are stored without looking up their device.
+        - devices are only cached once the transaction that read or created them has been committed
+        - entries are invalidated whenever a device is saved or deleted
+        - when a cache alias is configured, the devices are also shared between processes through that cache
+    """
+
+    key_prefix = 'telemetry:device:'
+
+    def __init__(self, max_size, alias=None):
+        self.max_size = max_size
+        self.alias = alias
+        self._devices = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self.alias] if self.alias else None
+
+    def key(self, identnr):
+        return f'{self.key_prefix}{identnr}'
+
+    def get_many(self, identnrs):
+        """:return dict(identnr: device) the cached devices among the [identnrs]"""
+        devices = {}
+        with self._lock:
+            for identnr in identnrs:
+                device = self._devices.get(identnr)
+                if device is not None:
+                    self._devices.move_to_end(identnr)
+                    devices[identnr] = device
+
+        missing = [identnr for identnr in identnrs if identnr not in devices]
+        if missing and self.shared is not None:
+            shared = self.shared.get_many([self.key(identnr) for identnr in missing])
+            found = list(shared.values())
+            self._store(found)
+            devices.update((device.identnr, device) for device in found)
+
+        return devices
+
+    def set_many(self, devices):
+        """caches the [devices] once the current transaction is committed"""
+        devices = list(devices)
+        if not devices or self.max_size < 1:
+            return
+
+        def store():
+            self._store(devices)
+            if self.shared is not None:
+                self.shared.set_many({self.key(device.identnr): device for device in devices})
+
+        transaction.on_commit(store)
+
+    def invalidate(self, identnr):
+        with self._lock:
+            self._devices.pop(identnr, None)
+        if self.shared is not None:
+            self.shared.delete(self.key(identnr))
+
+    def clear(self):
+        with self._lock:
+            self._devices.clear()
+
+    def _store(self, devices):
+        with self._lock:
+            for device in devices:
+                self._devices[device.identnr] = device
+                self._devices.move_to_end(device.identnr)
+            while len(self._devices) > self.max_size:
+                self._devices.popitem(last=False)
+
+
+device_cache = DeviceCache(getattr(settings, 'TELEMETRY_DEVICE_CACHE_SIZE', 10000),
+                           getattr(settings, 'TELEMETRY_DEVICE_CACHE_ALIAS', None))
+
+
+class ExportCache:
+    """ExportCache
+        cache of the rendered latest telemetry CSV exports, keyed by their query parameters. every entry is stored
+        under the version of the data it was produced from, so that entries are invalidated by changing versions
+        instead of looking them up:
+        - the export of a single device (`identnr` filter) uses the version of that device
+        - any other export uses the version of the whole fleet
+        - both also use a generation which invalidates every entry at once
+        checking whether an entry is still current only reads the cache, never the database.
+        the versions are changed by every process storing messages, so the exports are only cached through a cache
+        shared between processes: the export cache is disabled when the alias is a local memory or dummy cache.
+    """
+
+    key_prefix = 'telemetry:export:'
+
+    def __init__(self, alias, timeout):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def enabled(self):
+        return not isinstance(self.cache, (LocMemCache, DummyCache))
+
+    def version_key(self, identnr=None):
+        if identnr is None:
+            return f'{self.key_prefix}version:fleet'
+        return f'{self.key_prefix}version:{identnr}'
+
+    def get_tag(self, query_params):
+        """:return str: tag of the current version of the export requested with the [query_params]"""
+        identnr = query_params.get('identnr')
+        if identnr is not None:
+            try:
+                identnr = int(identnr)
+            except ValueError:
+                pass
+
+        generation_key = f'{self.key_prefix}generation'
+        version_key = self.version_key(identnr)
+        versions = self.cache.get_many([generation_key, version_key])
+        # a version which is not cached (yet or anymore) gets a new one, which no stored entry can be under
+        for key in (generation_key, version_key):
+            if key not in versions:
+                self.cache.add(key, uuid.uuid4().hex, None)
+                versions[key] = self.cache.get(key)
+
+        params = urlencode(sorted((name, value) for name in query_params for value in query_params.getlist(name)))
+        return hashlib.md5(f'{versions[generation_key]}:{versions[version_key]}:{params}'.encode()).hexdigest()
+
+    def get(self, tag):
+        """:return tuple(content, content_type): the export stored under the [tag], or None"""
+        return self.cache.get(f'{self.key_prefix}{tag}')
+
+    def set(self, tag, content, content_type):
+        self.cache.set(f'{self.key_prefix}{tag}', (content, content_type), self.timeout)
+
+    def invalidate(self, identnrs):
+        """invalidates the exports of the devices with the [identnrs] and of the fleet once the current transaction
+        is committed, so that the new versions are not read before the changed data can be
+        """
+        identnrs = set(identnrs)
+        if not identnrs or not self.enabled:
+            return
+
+        keys = [self.version_key(identnr) for identnr in identnrs] + [self.version_key()]
+        transaction.on_commit(lambda: self.cache.set_many({key: uuid.uuid4().hex for key in keys}, None))
+
+    def clear(self):
+        """invalidates every export once the current transaction is committed"""
+        if not self.enabled:
+            return
+        transaction.on_commit(lambda: self.cache.set(f'{self.key_prefix}generation', uuid.uuid4().hex, None))
+
+
+export_cache = ExportCache(getattr(settings, 'TELEMETRY_EXPORT_CACHE_ALIAS', 'default'),
+                           getattr(settings, 'TELEMETRY_EXPORT_CACHE_TIMEOUT', 3600))
@@ -0,0 +1,32 @@
+from django_filters import rest_framework as filters
+
+from telemetry.models import Message, DailyConsumption, MonthlyConsumption
+
+
+class MessageFilter(filters.FilterSet):
+    """filters the messages by device and by time range of reception"""
+    identnr = filters.NumberFilter(field_name='device__identnr')
+    created_after = filters.IsoDateTimeFilter(field_name='created_at', lookup_expr='gte')
+    created_before = filters.IsoDateTimeFilter(field_name='created_at', lookup_expr='lt')
+
+    class Meta:
+        model = Message
+        fields = ['identnr', 'created_after', 'created_before']
+
+
+class DailyConsumptionFilter(filters.FilterSet):
+    """filters the daily consumption history of a device by range of days"""
+    identnr = filters.NumberFilter(field_name='device__identnr', required=True)
+    start = filters.DateFilter(field_name='period', lookup_expr='gte')
+    end = filters.DateFilter(field_name='period', lookup_expr='lte')
+
+    class Meta:
+        model = DailyConsumption
+        fields = ['identnr', 'start', 'end']
+
+
+class MonthlyConsumptionFilter(DailyConsumptionFilter):
+    """filters the monthly consumption history of a device by range of months"""
+
+    class Meta(DailyConsumptionFilter.Meta):
+        model = MonthlyConsumption
@@ -0,0 +1,149 @@
+import json
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+from telemetry.models import TIME_AND_DATE_DIMENSION, DATE_DIMENSION, TIME_POINT_FORMAT
+
+# identnr offset of the generated devices so that they do not collide with real ones
+LOAD_TEST_IDENTNR = 920000000
+# dimensions of the generated measurements
+MEASUREMENT_DIMENSIONS = ['Energy (Wh)', 'Volume (m m^3)', 'Power (W)', 'Flow Temperature (1e-1 deg C)']
+
+
+def generate_payloads(devices, values, history, seed=0, start=datetime(2020, 7, 1, 12)):
+    """generate_payloads
+        generates gateway payloads in the shape accepted by DeviceTelemetrySerializer, [history] daily messages
+        of [values] values for each of [devices] devices, oldest first. storage record 0 holds the time of the
+        message and storage record 1 the due date, the other values being measurements.
+        the same arguments always generate the same payloads.
+        :return generator of dict: the payloads
+    """
+    generator = random.Random(seed)
+    readings = [generator.randrange(1000, 100000) for _ in range(devices)]
+    for day in range(history):
+        date = start - timedelta(days=history - 1 - day)
+        due_date = date.replace(day=1, hour=0, minute=0) - timedelta(days=1)
+        for number in range(devices):
+            readings[number] += generator.randrange(0, 50)
+            data = [
+                {'value': date.strftime(TIME_POINT_FORMAT), 'tariff': 0, 'subunit': 0,
+                 'dimension': TIME_AND_DATE_DIMENSION, 'storagenr': 0},
+                {'value': due_date.strftime(TIME_POINT_FORMAT), 'tariff': 0, 'subunit': 0,
+                 'dimension': DATE_DIMENSION, 'storagenr': 1},
+            ]
+            for index in range(max(values - len(data), 0)):
+                data.append({'value': str(readings[number] - index), 'tariff': index % 2, 'subunit': 0,
+                             'dimension': MEASUREMENT_DIMENSIONS[index % len(MEASUREMENT_DIMENSIONS)],
+                             'storagenr': index // len(MEASUREMENT_DIMENSIONS)})
+            yield {
+                'data': data[:values],
+                'device': {'type': 7, 'status': 0, 'identnr': LOAD_TEST_IDENTNR + number, 'version': 112,
+                           'accessnr': generator.randrange(0, 256), 'manufacturer': 11298},
+            }
+
+
+def percentile(timings, percent):
+    """:return float: the [percent] percentile of the sorted [timings], by nearest rank"""
+    if not timings:
+        return 0
+    rank = max(int(round(percent / 100 * len(timings) + 0.5)) - 1, 0)
+    return timings[min(rank, len(timings) - 1)]
+
+
+class LoadDriver:
+    """LoadDriver
+        sends requests to a running server from a pool of [concurrency] threads, each with its own session,
+        and reports for every scenario the latency percentiles, the throughput and the SQL queries per request
+        read from the X-DB-Queries header of the responses
+    """
+
+    def __init__(self, base_url, concurrency, timeout=60):
+        self.base_url = base_url.rstrip('/') + '/'
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._sessions = threading.local()
+
+    @property
+    def session(self):
+        if not hasattr(self._sessions, 'session'):
+            self._sessions.session = requests.Session()
+        return self._sessions.session
+
+    def send(self, method, path, body=None):
+        """:return tuple(seconds, status, queries): the outcome of a request"""
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, data=body, timeout=self.timeout,
+                                            headers={'Content-Type': 'application/json'} if body else None)
+        except requests.RequestException:
+            return time.perf_counter() - started, None, None
+        queries = response.headers.get('X-DB-Queries')
+        return time.perf_counter() - started, response.status_code, int(queries) if queries else None
+
+    def run(self, requests_to_send):
+        """sends the [requests_to_send], tuples of (method, path, body)
+            :return dict: the statistics of the requests
+        """
+        started = time.perf_counter()
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            outcomes = list(executor.map(lambda request: self.send(*request), requests_to_send))
+        elapsed = time.perf_counter() - started
+
+        timings = sorted(seconds * 1000 for seconds, status, queries in outcomes)
+        queries = [queries for seconds, status, queries in outcomes if queries is not None]
+        return {
+            'requests': len(outcomes),
+            'errors': sum(1 for seconds, status, queries in outcomes if status is None or status >= 400),
+            'throughput': round(len(outcomes) / elapsed, 1) if elapsed else 0,
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'queries_per_request': round(statistics.mean(queries), 2) if queries else None,
+        }
+
+
+def scenarios(payloads, repeat):
+    """builds the requests of the load test scenarios from the generated [payloads]
+        :return dict(name: list of tuple(method, path, body)): the requests of every scenario, in the order to run
+    """
+    bodies = [json.dumps(payload) for payload in payloads]
+    identnrs = sorted({payload['device']['identnr'] for payload in payloads})
+    return {
+        'ingest': [('POST', 'device_message/', body) for body in bodies],
+        'ingest_batch': [('POST', 'device_message/batch/', '[' + ','.join(bodies[start:start + 100]) + ']')
+                         for start in range(0, len(bodies), 100)],
+        'list': [('GET', 'device_message/?page_size=100', None)] * repeat,
+        'list_device': [('GET', f'device_message/?identnr={identnrs[number % len(identnrs)]}', None)
+                        for number in range(repeat)],
+        'export': [('GET', 'telemetry_cvs/?format=csv', None)] * repeat,
+        'export_device': [('GET', f'telemetry_cvs/?format=csv&identnr={identnrs[number % len(identnrs)]}', None)
+                          for number in range(repeat)],
+    }
+
+
+def compare(results, baseline, tolerance):
+    """compare
+        finds the regressions of the [results] against the [baseline]: a p95 latency more than [tolerance]
+        (a fraction) above the baseline, more queries per request or errors
+        :return list of str: the regressions found
+    """
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result['p95_ms'] > expected['p95_ms'] * (1 + tolerance):
+            regressions.append(f'{name}: p95 {result["p95_ms"]} ms, baseline {expected["p95_ms"]} ms')
+        if result['queries_per_request'] is not None and expected.get('queries_per_request') is not None \
+                and result['queries_per_request'] > expected['queries_per_request']:
+            regressions.append(f'{name}: {result["queries_per_request"]} queries per request, '
+                               f'baseline {expected["queries_per_request"]}')
+        if result['errors'] > expected.get('errors', 0):
+            regressions.append(f'{name}: {result["errors"]} failed requests')
+    return regressions
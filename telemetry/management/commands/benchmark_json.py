@@ -0,0 +1,76 @@
+import io
+import statistics
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from telemetry.parsers import ORJSONParser
+from telemetry.renderers import ORJSONRenderer
+
+
+def build_payload(values):
+    """gateway payload with [values] values, in the shape received by the ingest endpoint"""
+    return {
+        'data': [{'value': str(storagenr * 10), 'tariff': 0, 'subunit': 0, 'dimension': 'Energy (Wh)',
+                  'storagenr': storagenr} for storagenr in range(values)],
+        'device': {'type': 7, 'status': 0, 'identnr': 69656545, 'version': 112, 'accessnr': 34,
+                   'manufacturer': 11298},
+    }
+
+
+class Command(BaseCommand):
+    """benchmark_json
+        prints the time taken to parse an ingest payload and to render a page of messages with the
+        JSONParser and JSONRenderer of django rest framework and with their orjson counterparts,
+        after checking that both produce the same result.
+    """
+    help = 'Benchmark the JSON parsers and renderers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--values', type=int, default=30, help='values per message (default: 30)')
+        parser.add_argument('--page-size', type=int, default=100, help='messages per page (default: 100)')
+        parser.add_argument('--repeat', type=int, default=200, help='runs per parser and renderer (default: 200)')
+
+    def handle(self, *args, **options):
+        if min(options['values'], options['page_size'], options['repeat']) < 1:
+            raise CommandError('--values, --page-size and --repeat must be positive numbers')
+
+        payload = build_payload(options['values'])
+        page = {
+            'next': 'http://testserver/v1/api/device_message/?cursor=cD0yMDIwLTA3LTAx',
+            'previous': None,
+            'results': [dict(build_payload(options['values']), uuid=uuid.uuid4(), created_at=timezone.now())
+                        for _ in range(options['page_size'])],
+        }
+        body = JSONRenderer().render(payload)
+
+        if ORJSONRenderer().render(page) != JSONRenderer().render(page):
+            raise CommandError('The renderers do not produce the same output')
+        if ORJSONParser().parse(io.BytesIO(body)) != JSONParser().parse(io.BytesIO(body)):
+            raise CommandError('The parsers do not produce the same data')
+
+        self.stdout.write(f'{"":<24}{"json (us)":>12}{"orjson (us)":>14}{"speedup":>10}')
+        for name, legacy, fast in [
+            ('parse payload', lambda: JSONParser().parse(io.BytesIO(body)),
+             lambda: ORJSONParser().parse(io.BytesIO(body))),
+            ('render payload', lambda: JSONRenderer().render(payload), lambda: ORJSONRenderer().render(payload)),
+            ('render page', lambda: JSONRenderer().render(page), lambda: ORJSONRenderer().render(page)),
+        ]:
+            legacy_timing = self.measure(legacy, options['repeat'])
+            fast_timing = self.measure(fast, options['repeat'])
+            speedup = legacy_timing / fast_timing
+            self.stdout.write(f'{name:<24}{legacy_timing:>12.1f}{fast_timing:>14.1f}{speedup:>9.1f}x')
+
+    @staticmethod
+    def measure(run, repeat):
+        """:return float: median time in microseconds taken by [run]"""
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) * 1000000)
+        return statistics.median(timings)
@@ -0,0 +1,142 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+
+from telemetry.models import Device, Value, DeviceLatestTelemetry, TIME_AND_DATE_DIMENSION, DATE_DIMENSION
+
+# identnr offset of the generated devices so that they do not collide with real ones
+BENCHMARK_IDENTNR = 900000000
+
+# indexes of the value table before they were tuned for the latest measurement and due date queries
+LEGACY_INDEXES = [
+    'CREATE INDEX benchmark_value_storagenr ON telemetry_value (storagenr)',
+    'CREATE INDEX benchmark_value_time_point ON telemetry_value (time_point)',
+]
+TUNED_INDEXES = ['value_msg_dim_storagenr_idx', 'value_time_point_idx']
+
+
+class Command(BaseCommand):
+    """benchmark_queries
+        generates a dataset of gateway messages, then prints the EXPLAIN ANALYZE plan and the timings of the
+        latest measurement and due date queries with the tuned indexes and with the legacy ones.
+        everything is done in a transaction which is rolled back, nothing is left in the database.
+    """
+    help = 'Benchmark the latest measurement and due date queries before and after index tuning'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=1000, help='number of devices (default: 1000)')
+        parser.add_argument('--messages', type=int, default=50, help='messages per device (default: 50)')
+        parser.add_argument('--values', type=int, default=30, help='values per message (default: 30)')
+        parser.add_argument('--repeat', type=int, default=20, help='runs per query for the timings (default: 20)')
+        parser.add_argument('--no-plans', action='store_true', help='only print the timings')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('benchmark_queries requires PostgreSQL')
+        if min(options['devices'], options['messages'], options['values'], options['repeat']) < 1:
+            raise CommandError('--devices, --messages, --values and --repeat must be positive numbers')
+
+        self.options = options
+        with transaction.atomic():
+            started = time.monotonic()
+            device = self.generate_dataset(options['devices'], options['messages'], options['values'])
+            generated = Value.objects.filter(message__device__identnr__gt=BENCHMARK_IDENTNR).count()
+            self.stdout.write(f'Generated {generated} values in {time.monotonic() - started:.1f}s')
+
+            after = self.run_queries('tuned indexes', device)
+
+            with connection.cursor() as cursor:
+                for index in TUNED_INDEXES:
+                    cursor.execute(f'DROP INDEX {index}')
+                for statement in LEGACY_INDEXES:
+                    cursor.execute(statement)
+                cursor.execute('ANALYZE telemetry_value')
+            before = self.run_queries('legacy indexes', device)
+
+            self.stdout.write(f'\n{"query":<32}{"before (ms)":>14}{"after (ms)":>14}')
+            for name in after:
+                self.stdout.write(f'{name:<32}{before[name]:>14.3f}{after[name]:>14.3f}')
+
+            transaction.set_rollback(True)
+
+    def generate_dataset(self, devices, messages, values):
+        """inserts the devices, their messages and values with set based statements and returns a sample device"""
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO telemetry_device (uuid, created_at, updated_at, is_deleted, device_type, status, identnr,
+                                              version, accessnr, manufacturer)
+                SELECT md5(random()::text || d)::uuid, now(), now(), false, 7, 0, %s + d, 0, 0, 0
+                FROM generate_series(1, %s) d
+            """, [BENCHMARK_IDENTNR, devices])
+            cursor.execute("""
+                INSERT INTO telemetry_message (uuid, created_at, updated_at, is_deleted, device_id)
+                SELECT md5(random()::text || d.id || m)::uuid, now() - m * interval '1 day', now(), false, d.id
+                FROM telemetry_device d CROSS JOIN generate_series(1, %s) m
+                WHERE d.identnr > %s
+            """, [messages, BENCHMARK_IDENTNR])
+            # every storagenr holds a measurement and a time point, storagenr 0 being the time of the message
+            # and the others the due dates before it
+            cursor.execute("""
+                INSERT INTO telemetry_value (uuid, created_at, updated_at, is_deleted, message_id, value, tariff,
+                                             subunit, dimension, storagenr, time_point, measurement)
+                SELECT md5(random()::text || m.id || v)::uuid, m.created_at, m.created_at, false, m.id,
+                       CASE WHEN v %% 2 = 0 THEN (v * 1000 + m.id)::text
+                            ELSE to_char(m.created_at - v / 2 * interval '1 month', 'YYYY-MM-DD"T"HH24:MI:SS".000000"')
+                       END,
+                       0, 0,
+                       CASE WHEN v %% 2 = 0 THEN 'Energy (Wh)'
+                            WHEN v / 2 = 0 THEN %s
+                            ELSE %s
+                       END,
+                       v / 2,
+                       CASE WHEN v %% 2 = 1 THEN m.created_at - v / 2 * interval '1 month' END,
+                       CASE WHEN v %% 2 = 0 THEN v * 1000 + m.id END
+                FROM telemetry_message m JOIN telemetry_device d ON d.id = m.device_id
+                CROSS JOIN generate_series(0, %s - 1) v
+                WHERE d.identnr > %s
+            """, [TIME_AND_DATE_DIMENSION, DATE_DIMENSION, values, BENCHMARK_IDENTNR])
+            # check the deferred foreign keys now so that the indexes can be swapped later in the transaction
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            cursor.execute('ANALYZE telemetry_device')
+            cursor.execute('ANALYZE telemetry_message')
+            cursor.execute('ANALYZE telemetry_value')
+
+        return Device.objects.get(identnr=BENCHMARK_IDENTNR + (devices + 1) // 2)
+
+    def hot_queries(self, device):
+        """the queries behind the latest measurement, the due date and the dimension of a device"""
+        message = device.messages.order_by('-created_at').first()
+        device_ids = list(Device.objects.filter(identnr__gt=BENCHMARK_IDENTNR).values_list('id', flat=True)[:100])
+        return {
+            'latest time point of device': Value.objects.filter(
+                message__device=device, dimension__exact=TIME_AND_DATE_DIMENSION, time_point__isnull=False
+            ).order_by('-time_point')[:1],
+            'measurement at storagenr': message.data.filter(storagenr=0, dimension__exact='Energy (Wh)')[:1],
+            'due date of message': message.data.filter(
+                dimension__exact=DATE_DIMENSION, time_point__isnull=False
+            ).order_by('-time_point')[:1],
+            'dimension of message': message.data.order_by().values('dimension').annotate(count=Count('id')),
+            'rebuild latest (100 devices)': lambda: DeviceLatestTelemetry.rebuild(device_ids),
+        }
+
+    def run_queries(self, label, device):
+        self.stdout.write(f'\n=== {label} ===')
+        timings = {}
+        for name, query in self.hot_queries(device).items():
+            if callable(query):
+                run = query
+            else:
+                run = (lambda query=query: list(query.all()))
+                if not self.options['no_plans']:
+                    self.stdout.write(f'\n--- {name}\n{query.explain(analyze=True)}')
+
+            durations = []
+            for _ in range(self.options['repeat']):
+                started = time.perf_counter()
+                run()
+                durations.append((time.perf_counter() - started) * 1000)
+            timings[name] = statistics.median(durations)
+        return timings
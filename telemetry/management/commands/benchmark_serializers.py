@@ -0,0 +1,81 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Prefetch
+
+from telemetry.models import Message, Value
+from telemetry.serializers import DeviceTelemetrySerializer, ValueSerializer, create_telemetry_messages
+
+# identnr offset of the generated devices so that they do not collide with real ones
+BENCHMARK_IDENTNR = 910000000
+
+
+def legacy_representation(messages):
+    """representation of the messages as built before the fast path, with a ValueSerializer per value"""
+    representation = []
+    for message in messages:
+        values_data = [ValueSerializer(instance=value).data for value in message.data.all()]
+        representation.append(DeviceTelemetrySerializer.represent(message, values_data))
+    return representation
+
+
+class Command(BaseCommand):
+    """benchmark_serializers
+        creates a page of gateway messages and prints the time taken to read and serialize it with the
+        legacy path, a ValueSerializer per value of prefetched model instances, and with the list serializer
+        reading the values as plain rows. everything is done in a transaction which is rolled back.
+    """
+    help = 'Benchmark the serialization of a page of telemetry messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000, help='number of messages (default: 1000)')
+        parser.add_argument('--values', type=int, default=30, help='values per message (default: 30)')
+        parser.add_argument('--repeat', type=int, default=5, help='runs per serializer (default: 5)')
+
+    def handle(self, *args, **options):
+        if min(options['messages'], options['values'], options['repeat']) < 1:
+            raise CommandError('--messages, --values and --repeat must be positive numbers')
+
+        with transaction.atomic():
+            messages = create_telemetry_messages([
+                self.build_message(number, options['values']) for number in range(options['messages'])
+            ])
+            queryset = Message.objects.filter(id__in=[message.id for message in messages]) \
+                .select_related('device').order_by('-created_at')
+
+            legacy_queryset = queryset.prefetch_related(Prefetch('data', queryset=Value.objects.order_by('storagenr')))
+            timings = {
+                'legacy': self.measure(lambda: legacy_representation(legacy_queryset.all()), options['repeat']),
+                'fast': self.measure(lambda: DeviceTelemetrySerializer(queryset.all(), many=True).data,
+                                     options['repeat']),
+            }
+            fast = DeviceTelemetrySerializer(queryset.all(), many=True).data
+            if legacy_representation(legacy_queryset.all()) != fast:
+                raise CommandError('The serializers do not produce the same representation')
+
+            self.stdout.write(f'{options["messages"]} messages x {options["values"]} values')
+            for name, timing in timings.items():
+                self.stdout.write(f'{name:<10}{timing:>12.1f} ms')
+            self.stdout.write(f'speedup   {timings["legacy"] / timings["fast"]:>12.1f}x')
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def build_message(number, values):
+        data = [{'value': str(storagenr * 10), 'tariff': 0, 'subunit': 0, 'dimension': 'Energy (Wh)',
+                 'storagenr': storagenr} for storagenr in range(values)]
+        device = {'type': 7, 'status': 0, 'identnr': BENCHMARK_IDENTNR + number % 100, 'version': 112,
+                  'accessnr': 34, 'manufacturer': 11298}
+        return {'data': data, 'device': device}
+
+    @staticmethod
+    def measure(serialize, repeat):
+        """:return float: median time in milliseconds taken by [serialize]"""
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            serialize()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
@@ -0,0 +1,87 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from telemetry.models import DeviceLatestTelemetry, Dimension, Message, Value, get_ingest_key
+from telemetry.serializers import ValueSerializer
+
+
+class Command(BaseCommand):
+    """collapse_duplicates
+        finds the retransmitted messages stored before the ingest deduplicated them and collapses them into their
+        first transmission, a batch of messages per transaction:
+        - the ingest key of every message stored without one is computed from its content
+        - the first message of every key is kept and given the key, the later ones are deleted with their values,
+          the latest state of their devices being moved to the kept message beforehand
+        the consumption rollups of the devices which had duplicates are then rebuilt.
+    """
+    help = 'Collapse the retransmitted messages stored more than once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='number of messages checked per transaction (default: 1000)')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be a positive number')
+
+        # the dimensions of the packed values are cached before the transactions, in which they would not be
+        Dimension.get_names(Dimension.objects.values_list('id', flat=True))
+
+        checked = collapsed = 0
+        identnrs = set()
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                messages = list(Message.objects.select_related('device')
+                                .filter(id__gt=last_id, ingest_key__isnull=True).order_by('id')[:batch_size])
+                if not messages:
+                    break
+
+                duplicates = self.collapse_batch(messages)
+
+            checked += len(messages)
+            collapsed += len(duplicates)
+            identnrs.update(message.device.identnr for message in messages if message.id in duplicates)
+            last_id = messages[-1].id
+            self.stdout.write(f'{checked} messages checked, {collapsed} duplicates collapsed')
+
+        if identnrs:
+            call_command('rebuild_rollups', identnr=sorted(identnrs), stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Collapsed {collapsed} duplicated messages'))
+
+    @staticmethod
+    def collapse_batch(messages):
+        """:return dict(duplicate id: original id): the messages of the batch which have been collapsed"""
+        fields = ValueSerializer.Meta.fields
+        records = {message.id: [] for message in messages}
+        rows = Value.objects.filter(message_id__in=records).order_by().values_list('message_id', *fields)
+        for message_id, *row in rows:
+            records[message_id].append(dict(zip(fields, row)))
+        for message in messages:
+            if message.packed_values is not None:
+                dimension_names = Dimension.get_names(value[3] for value in message.packed_values)
+                records[message.id] = message.unpack_values(dimension_names)
+
+        keys = {message.id: get_ingest_key(message.device.identnr, records[message.id]) for message in messages}
+        originals = dict(Message.all_objects.filter(ingest_key__in=set(keys.values())).values_list('ingest_key', 'id'))
+
+        kept, duplicates = [], {}
+        for message in messages:
+            key = keys[message.id]
+            if key in originals:
+                duplicates[message.id] = originals[key]
+            else:
+                originals[key] = message.id
+                message.ingest_key = key
+                kept.append(message)
+        Message.objects.bulk_update(kept, ['ingest_key'])
+
+        latest_states = list(DeviceLatestTelemetry.all_objects.filter(message_id__in=duplicates))
+        for latest in latest_states:
+            latest.message_id = duplicates[latest.message_id]
+        DeviceLatestTelemetry.all_objects.bulk_update(latest_states, ['message'])
+        Message.objects.filter(id__in=duplicates).delete()
+
+        return duplicates
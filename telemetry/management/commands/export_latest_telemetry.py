@@ -0,0 +1,163 @@
+import csv
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from telemetry.api import LatestTelemetryCVSViewSet
+from telemetry.serializers import DeviceLatestTelemetryCVSSerializer
+
+# same columns in the same order as the telemetry_cvs export
+COLUMNS = sorted(DeviceLatestTelemetryCVSSerializer.Meta.fields)
+INTEGER_COLUMNS = ['device_id', 'device_manufacturer', 'device_type', 'device_version']
+
+
+def export_range(start, end, path, file_format):
+    """export_range
+        writes the rows of the devices with an id in [start, end) to the part file [path], ordered by id.
+        runs in a worker process, the part being written under a temporary name first so that only
+        complete parts are found when resuming.
+        :return int: number of exported devices
+    """
+    devices = LatestTelemetryCVSViewSet.queryset.filter(id__gte=start).order_by('id')
+    if end is not None:
+        devices = devices.filter(id__lt=end)
+    serializer = DeviceLatestTelemetryCVSSerializer()
+    rows = [serializer.to_representation(device) for device in devices.iterator(chunk_size=2000)]
+
+    if file_format == 'parquet':
+        import pyarrow
+        import pyarrow.parquet
+
+        table = pyarrow.Table.from_pydict({column: [row[column] for row in rows] for column in COLUMNS},
+                                          schema=parquet_schema())
+        pyarrow.parquet.write_table(table, f'{path}.tmp')
+    else:
+        with gzip.open(f'{path}.tmp', 'wt', newline='') as part:
+            csv.DictWriter(part, COLUMNS).writerows(rows)
+
+    os.replace(f'{path}.tmp', path)
+    return len(rows)
+
+
+def parquet_schema():
+    import pyarrow
+
+    return pyarrow.schema([(column, pyarrow.int64() if column in INTEGER_COLUMNS else pyarrow.string())
+                           for column in COLUMNS])
+
+
+class Command(BaseCommand):
+    """export_latest_telemetry
+        writes the latest telemetry of every device, as exported by telemetry_cvs, to a gzip compressed CSV
+        or to a Parquet file ordered by device id.
+        - the devices are split into ranges of ids whose rows are computed by a pool of worker processes,
+          each range being written to a part file in <output>.parts
+        - the ranges are recorded in a manifest so that an interrupted export can be resumed with --resume,
+          only the ranges without a part file being exported again
+        - the parts are then assembled in order into the output and removed
+    """
+    help = 'Export the latest telemetry of every device to a compressed CSV or Parquet file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='file to write the export to')
+        parser.add_argument('--format', choices=['csv', 'parquet'], default='csv',
+                            help='gzip compressed CSV or Parquet, which requires pyarrow (default: csv)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='number of worker processes (default: number of CPUs)')
+        parser.add_argument('--range-size', type=int, default=5000,
+                            help='number of devices exported per range (default: 5000)')
+        parser.add_argument('--resume', action='store_true',
+                            help='resume an interrupted export instead of starting over')
+
+    def handle(self, *args, **options):
+        if min(options['workers'], options['range_size']) < 1:
+            raise CommandError('--workers and --range-size must be positive numbers')
+        if options['format'] == 'parquet':
+            try:
+                import pyarrow.parquet  # noqa: F401
+            except ImportError:
+                raise CommandError('--format parquet requires pyarrow to be installed')
+
+        output = options['output']
+        parts = f'{output}.parts'
+        manifest = os.path.join(parts, 'manifest.json')
+
+        if options['resume']:
+            if not os.path.exists(manifest):
+                raise CommandError(f'There is no export of {output} to resume')
+            with open(manifest) as f:
+                export = json.load(f)
+            if export['format'] != options['format']:
+                raise CommandError(f'The export of {output} to resume is in the {export["format"]} format')
+            ranges = export['ranges']
+        else:
+            shutil.rmtree(parts, ignore_errors=True)
+            os.makedirs(parts)
+            ranges = self.split_ranges(options['range_size'])
+            with open(manifest, 'w') as f:
+                json.dump({'format': options['format'], 'ranges': ranges}, f)
+
+        part_paths = [os.path.join(parts, f'{number:06d}.part') for number in range(len(ranges))]
+        pending = [(number, start, end) for number, (start, end) in enumerate(ranges)
+                   if not os.path.exists(part_paths[number])]
+        if len(pending) < len(ranges):
+            self.stdout.write(f'Resuming the export of {output}, {len(ranges) - len(pending)} of {len(ranges)} '
+                              f'ranges already exported')
+
+        exported = 0
+        started = time.monotonic()
+        # the workers are forked so that they inherit the configured django process, without any connection
+        # to the database which would then be shared with it
+        connections.close_all()
+        with ProcessPoolExecutor(options['workers'], mp_context=multiprocessing.get_context('fork')) as executor:
+            futures = [executor.submit(export_range, start, end, part_paths[number], options['format'])
+                       for number, start, end in pending]
+            for done, future in enumerate(as_completed(futures), 1):
+                exported += future.result()
+                self.report_progress(exported, done, len(futures), started)
+
+        self.assemble(output, part_paths, options['format'])
+        shutil.rmtree(parts)
+        self.stdout.write(self.style.SUCCESS(f'Exported the latest telemetry to {output}'))
+
+    @staticmethod
+    def split_ranges(range_size):
+        """:return list(list(start, end)): ranges of [range_size] device ids, the last one being open ended so
+        that devices created while the export is interrupted are exported when it is resumed
+        """
+        ids = list(LatestTelemetryCVSViewSet.queryset.order_by('id').values_list('id', flat=True))
+        starts = ids[::range_size] or [0]
+        return [[start, end] for start, end in zip(starts, starts[1:] + [None])]
+
+    @staticmethod
+    def assemble(output, part_paths, file_format):
+        if file_format == 'parquet':
+            import pyarrow.parquet
+
+            with pyarrow.parquet.ParquetWriter(f'{output}.tmp', parquet_schema()) as writer:
+                for path in part_paths:
+                    writer.write_table(pyarrow.parquet.read_table(path))
+        else:
+            header = io.StringIO()
+            csv.writer(header).writerow(COLUMNS)
+            # a sequence of gzip members is a valid gzip file, so the parts are appended as they are
+            with open(f'{output}.tmp', 'wb') as f:
+                f.write(gzip.compress(header.getvalue().encode()))
+                for path in part_paths:
+                    with open(path, 'rb') as part:
+                        shutil.copyfileobj(part, f)
+
+        os.replace(f'{output}.tmp', output)
+
+    def report_progress(self, exported, done, total, started):
+        elapsed = time.monotonic() - started
+        rate = exported / elapsed if elapsed else 0
+        self.stdout.write(f'{done}/{total} ranges, {exported} devices exported ({rate:.0f} devices/s)')
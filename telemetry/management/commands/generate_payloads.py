@@ -0,0 +1,34 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from telemetry.loadtest import generate_payloads
+
+
+class Command(BaseCommand):
+    """generate_payloads
+        writes synthetic gateway payloads to a JSONL file which can be loaded with import_telemetry or
+        sent by load_test
+    """
+    help = 'Generate synthetic gateway payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='JSONL file to write the payloads to')
+        parser.add_argument('--devices', type=int, default=100, help='number of devices (default: 100)')
+        parser.add_argument('--values', type=int, default=30, help='values per message (default: 30)')
+        parser.add_argument('--history', type=int, default=10,
+                            help='daily messages per device (default: 10)')
+        parser.add_argument('--seed', type=int, default=0, help='seed of the generated readings (default: 0)')
+
+    def handle(self, *args, **options):
+        if min(options['devices'], options['values'], options['history']) < 1:
+            raise CommandError('--devices, --values and --history must be positive numbers')
+
+        written = 0
+        with open(options['path'], 'w') as f:
+            for payload in generate_payloads(options['devices'], options['values'], options['history'],
+                                             options['seed']):
+                f.write(json.dumps(payload) + '\n')
+                written += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Generated {written} payloads in {options["path"]}'))
@@ -0,0 +1,110 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from telemetry.serializers import DeviceTelemetrySerializer, create_telemetry_messages
+
+
+class Command(BaseCommand):
+    """import_telemetry
+        streams a JSONL file of gateway payloads (one payload per line, in the shape accepted by
+        DeviceTelemetrySerializer) into the database in batches, keeping only one batch in memory.
+        the byte offset and line number of the last committed batch are written to a checkpoint file so that an
+        interrupted import can be resumed from where it stopped.
+    """
+    help = 'Import historical telemetry from a JSONL file of gateway payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='JSONL file with one gateway payload per line')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='number of messages committed per transaction (default: 1000)')
+        parser.add_argument('--checkpoint', help='checkpoint file (default: <path>.checkpoint)')
+        parser.add_argument('--restart', action='store_true',
+                            help='ignore an existing checkpoint and import from the beginning of the file')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        batch_size = options['batch_size']
+        checkpoint = options['checkpoint'] or f'{path}.checkpoint'
+
+        if batch_size < 1:
+            raise CommandError('--batch-size must be a positive number')
+        if not os.path.exists(path):
+            raise CommandError(f'{path} does not exist')
+
+        offset, line_number = (0, 0) if options['restart'] else self.read_checkpoint(checkpoint)
+        if offset:
+            self.stdout.write(f'Resuming {path} from byte offset {offset} (line {line_number + 1})')
+
+        imported = skipped = 0
+        started = time.monotonic()
+
+        with open(path, 'rb') as stream:
+            stream.seek(offset)
+            batch = []
+            for line in iter(stream.readline, b''):
+                line_number += 1
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    batch.append(json.loads(line))
+                except ValueError as error:
+                    self.stderr.write(f'Skipping line {line_number}: invalid JSON ({error})')
+                    skipped += 1
+                    continue
+
+                if len(batch) >= batch_size:
+                    created, invalid = self.import_batch(batch)
+                    imported, skipped = imported + created, skipped + invalid
+                    self.write_checkpoint(checkpoint, stream.tell(), line_number)
+                    self.report_progress(imported, skipped, started)
+                    batch = []
+
+            if batch:
+                created, invalid = self.import_batch(batch)
+                imported, skipped = imported + created, skipped + invalid
+            self.write_checkpoint(checkpoint, stream.tell(), line_number)
+
+        self.report_progress(imported, skipped, started)
+        self.stdout.write(self.style.SUCCESS(f'Imported {imported} messages from {path}'))
+
+    def import_batch(self, payloads):
+        """validates a batch of payloads and creates the valid ones in a single transaction"""
+        validated_data = []
+        for payload in payloads:
+            serializer = DeviceTelemetrySerializer(data=payload)
+            if serializer.is_valid():
+                validated_data.append(serializer.validated_data)
+            else:
+                self.stderr.write(f'Skipping invalid payload: {serializer.errors}')
+
+        with transaction.atomic():
+            create_telemetry_messages(validated_data)
+
+        return len(validated_data), len(payloads) - len(validated_data)
+
+    def report_progress(self, imported, skipped, started):
+        elapsed = time.monotonic() - started
+        rate = imported / elapsed if elapsed else 0
+        self.stdout.write(f'{imported} messages imported, {skipped} skipped ({rate:.0f} rows/s)')
+
+    @staticmethod
+    def read_checkpoint(checkpoint):
+        """:return tuple(offset, line_number): the byte offset and number of the last line of the last committed
+        batch, or (0, 0) when there is no checkpoint"""
+        if not os.path.exists(checkpoint):
+            return 0, 0
+        with open(checkpoint) as f:
+            offset, line_number = f.read().split()
+        return int(offset), int(line_number)
+
+    @staticmethod
+    def write_checkpoint(checkpoint, offset, line_number):
+        # write to a temporary file first so a crash never leaves a truncated checkpoint behind
+        with open(f'{checkpoint}.tmp', 'w') as f:
+            f.write(f'{offset} {line_number}')
+        os.replace(f'{checkpoint}.tmp', checkpoint)
@@ -0,0 +1,91 @@
+import json
+import os
+import platform
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from telemetry.loadtest import LoadDriver, compare, generate_payloads, scenarios
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json')
+
+
+class Command(BaseCommand):
+    """load_test
+        sends synthetic gateway payloads to the device_message endpoint of a running server, then reads them
+        back from the device_message and telemetry_cvs endpoints, and prints the latency percentiles, the
+        throughput and the SQL queries per request of every scenario.
+        the results are compared with a stored baseline, the command failing on a regression, and can be
+        stored as the new baseline with --save-baseline.
+        the generated devices have an identnr from 920000000 on and are left in the database of the server.
+    """
+    help = 'Load test the ingest and export endpoints of a running server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000/v1/api/',
+                            help='base url of the API (default: http://localhost:8000/v1/api/)')
+        parser.add_argument('--devices', type=int, default=50, help='number of devices (default: 50)')
+        parser.add_argument('--values', type=int, default=30, help='values per message (default: 30)')
+        parser.add_argument('--history', type=int, default=5, help='daily messages per device (default: 5)')
+        parser.add_argument('--repeat', type=int, default=100,
+                            help='requests sent by each read scenario (default: 100)')
+        parser.add_argument('--concurrency', type=int, default=8, help='concurrent requests (default: 8)')
+        parser.add_argument('--scenario', action='append',
+                            help='only run this scenario, can be repeated (default: all of them)')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                            help=f'baseline to compare the results with (default: {DEFAULT_BASELINE})')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='fraction by which the p95 latency may exceed the baseline (default: 0.25)')
+        parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+
+    def handle(self, *args, **options):
+        if min(options['devices'], options['values'], options['history'], options['repeat'],
+               options['concurrency']) < 1:
+            raise CommandError('--devices, --values, --history, --repeat and --concurrency must be positive numbers')
+
+        payloads = list(generate_payloads(options['devices'], options['values'], options['history']))
+        requests_to_send = scenarios(payloads, options['repeat'])
+        unknown = set(options['scenario'] or []) - set(requests_to_send)
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}, '
+                               f'expected some of {", ".join(requests_to_send)}')
+
+        driver = LoadDriver(options['url'], options['concurrency'])
+        results = {}
+        self.stdout.write(f'{"scenario":<16}{"requests":>10}{"errors":>8}{"req/s":>10}{"p50 ms":>10}'
+                          f'{"p95 ms":>10}{"p99 ms":>10}{"queries":>10}')
+        for name, scenario in requests_to_send.items():
+            if options['scenario'] and name not in options['scenario']:
+                continue
+            result = results[name] = driver.run(scenario)
+            queries = '-' if result['queries_per_request'] is None else result['queries_per_request']
+            self.stdout.write(f'{name:<16}{result["requests"]:>10}{result["errors"]:>8}{result["throughput"]:>10}'
+                              f'{result["p50_ms"]:>10}{result["p95_ms"]:>10}{result["p99_ms"]:>10}{queries:>10}')
+
+        if options['save_baseline']:
+            baseline = {
+                'created_at': timezone.now().isoformat(),
+                'environment': {'python': platform.python_version(), 'machine': platform.machine(),
+                                'processors': os.cpu_count()},
+                'options': {name: options[name] for name in ('devices', 'values', 'history', 'repeat',
+                                                             'concurrency')},
+                'scenarios': results,
+            }
+            os.makedirs(os.path.dirname(os.path.abspath(options['baseline'])), exist_ok=True)
+            with open(options['baseline'], 'w') as f:
+                json.dump(baseline, f, indent=2)
+                f.write('\n')
+            self.stdout.write(self.style.SUCCESS(f'Stored the results as the baseline in {options["baseline"]}'))
+            return
+
+        if not os.path.exists(options['baseline']):
+            self.stdout.write(f'There is no baseline in {options["baseline"]} to compare the results with')
+            return
+
+        with open(options['baseline']) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['scenarios'], options['tolerance'])
+        if regressions:
+            raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regression against the baseline'))
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from telemetry.models import Dimension, Message, Value
+from telemetry.serializers import ValueSerializer
+
+
+class Command(BaseCommand):
+    """pack_values
+        converts the messages whose values are stored as Value rows to the packed storage mode, a batch of
+        messages per transaction: their values are packed into the message rows and the Value rows deleted
+    """
+    help = 'Pack the values of the messages stored as Value rows into their messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='number of messages converted per transaction (default: 1000)')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be a positive number')
+
+        fields = ValueSerializer.Meta.fields
+        packed = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                messages = list(Message.objects.select_for_update().filter(id__gt=last_id, packed_values__isnull=True)
+                                .order_by('id')[:batch_size])
+                if not messages:
+                    break
+
+                values = {message.id: [] for message in messages}
+                rows = Value.objects.filter(message_id__in=values).order_by('message_id', 'storagenr', 'id') \
+                    .values_list('message_id', *fields)
+                for message_id, *row in rows:
+                    values[message_id].append(dict(zip(fields, row)))
+
+                dimension_ids = Dimension.get_ids(value['dimension'] for message_values in values.values()
+                                                  for value in message_values)
+                for message in messages:
+                    message.packed_values = Message.pack_values(values[message.id], dimension_ids)
+                    message.latest_date = Message.get_latest_date(values[message.id])
+                Message.objects.bulk_update(messages, ['packed_values', 'latest_date'])
+                Value.objects.filter(message_id__in=values).delete()
+
+            packed += len(messages)
+            last_id = messages[-1].id
+            self.stdout.write(f'{packed} messages packed')
+
+        self.stdout.write(self.style.SUCCESS(f'Packed the values of {packed} messages'))
@@ -0,0 +1,96 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from telemetry.models import QueuedMessage
+from telemetry.serializers import DeviceTelemetrySerializer, create_telemetry_messages
+
+logger = logging.getLogger('api')
+
+
+class Command(BaseCommand):
+    """process_ingest_queue
+        drains the ingest queue, creating the queued gateway payloads in batches with bulk writes.
+        several workers can run at the same time, each batch being locked with SKIP LOCKED so that
+        a payload is only processed by one of them. payloads which cannot be stored are marked as failed
+        and can be put back in the queue with --replay.
+    """
+    help = 'Store the gateway payloads waiting in the ingest queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='number of payloads stored per transaction (default: 500)')
+        parser.add_argument('--loop', action='store_true',
+                            help='keep waiting for new payloads once the queue is drained')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='seconds to wait before polling an empty queue again with --loop (default: 1)')
+        parser.add_argument('--replay', action='store_true',
+                            help='put the failed payloads back in the queue before processing it')
+        parser.add_argument('--stats', action='store_true', help='only print the metrics of the queue')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be a positive number')
+
+        if options['stats']:
+            stats = QueuedMessage.stats()
+            self.stdout.write(' | '.join(f'{name}: {value}' for name, value in stats.items()))
+            return
+
+        if options['replay']:
+            replayed = QueuedMessage.objects.filter(status=QueuedMessage.FAILED) \
+                .update(status=QueuedMessage.PENDING, error=None)
+            self.stdout.write(f'Replaying {replayed} failed payloads')
+
+        while True:
+            processed = self.process_batch(options['batch_size'])
+            if processed:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def process_batch(self, batch_size):
+        """stores a batch of pending payloads
+            :return int: number of payloads taken from the queue
+        """
+        with transaction.atomic():
+            queued = list(QueuedMessage.objects.select_for_update(skip_locked=True)
+                          .filter(status=QueuedMessage.PENDING).order_by('id')[:batch_size])
+            if not queued:
+                return 0
+
+            valid, failed = [], []
+            for entry in queued:
+                serializer = DeviceTelemetrySerializer(data=entry.payload)
+                if serializer.is_valid():
+                    valid.append((entry, {**serializer.validated_data, 'idempotency_key': entry.idempotency_key}))
+                else:
+                    entry.error = str(serializer.errors)
+                    failed.append(entry)
+
+            try:
+                with transaction.atomic():
+                    create_telemetry_messages([data for entry, data in valid])
+            except Exception:
+                # store the payloads one by one so that only the ones which cannot be stored are failed
+                logger.exception('Storing a batch of the ingest queue failed, storing its payloads one by one')
+                for entry, data in valid:
+                    try:
+                        with transaction.atomic():
+                            create_telemetry_messages([data])
+                    except Exception as error:
+                        entry.error = repr(error)
+                        failed.append(entry)
+
+            for entry in failed:
+                entry.status = QueuedMessage.FAILED
+                entry.attempts += 1
+            QueuedMessage.objects.bulk_update(failed, ['status', 'attempts', 'error'])
+            QueuedMessage.objects.filter(id__in=[entry.id for entry in queued]) \
+                .exclude(id__in=[entry.id for entry in failed]).delete()
+
+        logger.info(f'Ingest queue: {len(queued) - len(failed)} payloads stored, {len(failed)} failed')
+        return len(queued)
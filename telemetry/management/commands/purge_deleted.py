@@ -0,0 +1,96 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from telemetry.cache import export_cache
+from telemetry.models import Device, Message, Value, refresh_devices
+
+
+class Command(BaseCommand):
+    """purge_deleted
+        hard deletes the devices, messages and values soft deleted for longer than the retention period, a
+        bounded batch of rows per transaction so that no lock is held for long:
+        - the soft deleted values, then the soft deleted messages with all of their values
+        - the soft deleted devices, their messages being deleted in batches first
+        the soft deleted rows are found through the partial indexes on their deletion date, which only hold them.
+        the latest state and the consumption rollups of the devices whose messages are purged are rebuilt from
+        their other messages.
+    """
+    help = 'Hard delete the rows soft deleted for longer than the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, default=settings.TELEMETRY_PURGE_RETENTION_DAYS,
+                            help='days the soft deleted rows are kept '
+                                 f'(default: {settings.TELEMETRY_PURGE_RETENTION_DAYS})')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='number of rows deleted per transaction (default: 1000)')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='seconds to wait between transactions, to spread the load (default: 0)')
+
+    def handle(self, *args, **options):
+        if options['retention_days'] < 0:
+            raise CommandError('--retention-days must not be negative')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be a positive number')
+        self.batch_size = options['batch_size']
+        self.pause = options['pause']
+        before = timezone.now() - timedelta(days=options['retention_days'])
+
+        values = self.purge(Value.all_objects.filter(is_deleted=True, deleted_at__lt=before))
+        self.stdout.write(f'Purged {values} values')
+
+        messages = self.purge_messages(Message.all_objects.filter(is_deleted=True, deleted_at__lt=before))
+        self.stdout.write(f'Purged {messages} messages')
+
+        devices = 0
+        deleted_devices = Device.all_objects.filter(is_deleted=True, deleted_at__lt=before)
+        while True:
+            device_ids = list(deleted_devices.order_by().values_list('id', flat=True)[:self.batch_size])
+            if not device_ids:
+                break
+            messages += self.purge_messages(Message.all_objects.filter(device_id__in=device_ids), rebuild=False)
+            # the messages are gone, the latest state and the rollups of the devices are deleted with them
+            devices += self.purge(Device.all_objects.filter(id__in=device_ids))
+        self.stdout.write(f'Purged {devices} devices')
+
+        if messages or devices:
+            export_cache.clear()
+        self.stdout.write(self.style.SUCCESS(f'Purged {devices} devices, {messages} messages and {values} values '
+                                             f'soft deleted before {before.isoformat()}'))
+
+    def purge(self, rows, delete=None):
+        """deletes the [rows] by batches, a batch of ids being deleted by [delete] in its transaction if provided
+            :return int: number of rows deleted
+        """
+        deleted = 0
+        while True:
+            with transaction.atomic():
+                ids = list(rows.order_by().values_list('id', flat=True)[:self.batch_size])
+                if not ids:
+                    break
+                if delete is not None:
+                    delete(ids)
+                else:
+                    rows.model.all_objects.filter(id__in=ids).delete()
+            deleted += len(ids)
+            if self.pause:
+                time.sleep(self.pause)
+        return deleted
+
+    def purge_messages(self, messages, rebuild=True):
+        """deletes the [messages] and their values by batches
+            :param rebuild: rebuild the latest state and the rollups of the devices of the deleted messages
+            :return int: number of messages deleted
+        """
+        def delete(ids):
+            # the latest state of a device cascades with its message and is rebuilt from the remaining ones
+            device_ids = list(Message.all_objects.filter(id__in=ids).order_by().values_list('device_id', flat=True)
+                              .distinct()) if rebuild else []
+            Message.all_objects.filter(id__in=ids).delete()
+            refresh_devices(device_ids)
+
+        return self.purge(messages, delete)
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from telemetry.cache import export_cache
+from telemetry.models import Device, DeviceLatestTelemetry
+
+
+class Command(BaseCommand):
+    """rebuild_latest_telemetry
+        recomputes the latest telemetry of devices from their stored messages, a chunk of devices at a time,
+        with a fixed number of set based queries per chunk
+    """
+    help = 'Rebuild the latest telemetry of devices from their stored messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--identnr', type=int, nargs='*', help='only rebuild the devices with these identnr')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='number of devices rebuilt per transaction (default: 1000)')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be a positive number')
+
+        devices = Device.objects.order_by('id')
+        if options['identnr']:
+            devices = devices.filter(identnr__in=options['identnr'])
+
+        rebuilt = 0
+        last_id = 0
+        while True:
+            device_ids = list(devices.filter(id__gt=last_id).values_list('id', flat=True)[:chunk_size])
+            if not device_ids:
+                break
+
+            with transaction.atomic():
+                rebuilt += DeviceLatestTelemetry.rebuild(device_ids)
+            last_id = device_ids[-1]
+
+        # the cached exports may have been produced from the state which has been rebuilt
+        export_cache.clear()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the latest telemetry of {rebuilt} devices'))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from telemetry.models import Device, Dimension, rebuild_rollups
+
+
+class Command(BaseCommand):
+    """rebuild_rollups
+        recomputes the daily and monthly consumption rollups of devices from their stored messages, a chunk of
+        devices per transaction, to catch up with the messages stored before the rollups were maintained at ingest
+    """
+    help = 'Rebuild the daily and monthly consumption rollups of devices from their stored messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--identnr', type=int, nargs='*', help='only rebuild the devices with these identnr')
+        parser.add_argument('--chunk-size', type=int, default=100,
+                            help='number of devices rebuilt per transaction (default: 100)')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be a positive number')
+
+        devices = Device.objects.order_by('id')
+        if options['identnr']:
+            devices = devices.filter(identnr__in=options['identnr'])
+
+        # the dimensions of the packed values are cached before the transactions, in which they would not be
+        Dimension.get_names(Dimension.objects.values_list('id', flat=True))
+
+        rebuilt = readings_count = 0
+        last_id = 0
+        while True:
+            device_ids = list(devices.filter(id__gt=last_id).values_list('id', flat=True)[:chunk_size])
+            if not device_ids:
+                break
+
+            with transaction.atomic():
+                readings_count += rebuild_rollups(device_ids)
+
+            rebuilt += len(device_ids)
+            last_id = device_ids[-1]
+            self.stdout.write(f'{rebuilt} devices rebuilt from {readings_count} readings')
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the consumption rollups of {rebuilt} devices'))
+
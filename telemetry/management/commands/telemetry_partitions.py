@@ -0,0 +1,140 @@
+from datetime import date, datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from telemetry.models import Message, DeviceLatestTelemetry
+
+PARTITIONED_TABLE = 'telemetry_value'
+DEFAULT_PARTITION = 'telemetry_value_default'
+
+
+def add_months(month, months):
+    """:return date: first day of the month [months] after [month]"""
+    year, index = divmod(month.year * 12 + month.month - 1 + months, 12)
+    return date(year, index + 1, 1)
+
+
+def partition_name(month):
+    return f'{PARTITIONED_TABLE}_y{month.year}m{month.month:02d}'
+
+
+class Command(BaseCommand):
+    """telemetry_partitions
+        manages the monthly partitions of the value table
+        - creates the partitions of the coming months, and of the months whose rows are still in the default
+          partition by moving those rows into their own partition
+        - detaches (and optionally drops) the partitions older than a retention month, which does not need to
+          delete the rows one by one, then deletes in batches the messages left without values. a detached
+          partition which is kept loses its foreign key to the messages, whose values it then only archives
+    """
+    help = 'Create, split out and retire the monthly partitions of the value table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=3,
+                            help='number of months after the current one to create partitions for (default: 3)')
+        parser.add_argument('--detach-before', help='detach the partitions of the months before this one (YYYY-MM)')
+        parser.add_argument('--drop', action='store_true', help='drop the detached partitions')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='number of messages without values deleted per batch (default: 1000)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('telemetry_partitions requires PostgreSQL')
+        if options['months_ahead'] < 0 or options['batch_size'] < 1:
+            raise CommandError('--months-ahead must not be negative and --batch-size must be a positive number')
+        if options['drop'] and not options['detach_before']:
+            raise CommandError('--drop requires --detach-before')
+
+        detach_before = None
+        if options['detach_before']:
+            try:
+                detach_before = datetime.strptime(options['detach_before'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError('--detach-before must be a month formatted as YYYY-MM')
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            # check the deferred foreign keys now, partitions cannot be attached with pending trigger events
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+            current = timezone.now().date().replace(day=1)
+            months = {add_months(current, months) for months in range(options['months_ahead'] + 1)}
+            months.update(self.default_partition_months(cursor))
+            for month in sorted(months - set(self.partitions(cursor))):
+                self.create_partition(cursor, month)
+
+            if detach_before is not None:
+                for month, name in sorted(self.partitions(cursor).items()):
+                    if month < detach_before:
+                        cursor.execute(f'ALTER TABLE {PARTITIONED_TABLE} DETACH PARTITION {name}')
+                        if options['drop']:
+                            cursor.execute(f'DROP TABLE {name}')
+                        else:
+                            self.drop_foreign_keys(cursor, name)
+                        self.stdout.write(f'{"Dropped" if options["drop"] else "Detached"} partition {name}')
+
+        if detach_before is not None:
+            self.delete_empty_messages(detach_before, options['batch_size'])
+
+    @staticmethod
+    def partitions(cursor):
+        """:return dict(month: date, name: str) the monthly partitions attached to the value table"""
+        cursor.execute("""
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s AND child.relname != %s
+        """, [PARTITIONED_TABLE, DEFAULT_PARTITION])
+        return {datetime.strptime(name[len(PARTITIONED_TABLE):], '_y%Ym%m').date(): name
+                for name, in cursor.fetchall()}
+
+    @staticmethod
+    def drop_foreign_keys(cursor, name):
+        """drops the foreign keys a partition keeps once detached, which would prevent deleting its messages"""
+        cursor.execute("SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'", [name])
+        for constraint, in cursor.fetchall():
+            cursor.execute(f'ALTER TABLE {name} DROP CONSTRAINT {connection.ops.quote_name(constraint)}')
+
+    @staticmethod
+    def default_partition_months(cursor):
+        cursor.execute(f"SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC')::date "
+                       f"FROM {DEFAULT_PARTITION}")
+        return {month for month, in cursor.fetchall()}
+
+    def create_partition(self, cursor, month):
+        name = partition_name(month)
+        bounds = [f'{month.isoformat()} 00:00:00+00', f'{add_months(month, 1).isoformat()} 00:00:00+00']
+
+        # rows of the month which have been stored in the default partition are moved into the new partition
+        # before attaching it, as a partition overlapping rows of the default partition cannot be created
+        cursor.execute(f'CREATE TABLE {name} (LIKE {PARTITIONED_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute(f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """, bounds)
+        moved = cursor.rowcount
+        cursor.execute(f'ALTER TABLE {PARTITIONED_TABLE} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)',
+                       bounds)
+
+        self.stdout.write(f'Created partition {name} with {moved} rows from the default partition')
+
+    def delete_empty_messages(self, before, batch_size):
+        """deletes the messages created before the retention month which have no values left, the packed messages
+        holding their values being kept"""
+        before = timezone.make_aware(datetime.combine(before, time()), timezone.utc)
+        messages = Message.all_objects.filter(created_at__lt=before, data__isnull=True, packed_values__isnull=True) \
+            .exclude(id__in=DeviceLatestTelemetry.all_objects.values('message_id'))
+
+        deleted = 0
+        while True:
+            ids = list(messages.order_by().values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            with transaction.atomic():
+                Message.all_objects.filter(id__in=ids).delete()
+            deleted += len(ids)
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} messages without values'))
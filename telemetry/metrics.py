@@ -0,0 +1,114 @@
+import threading
+from collections import defaultdict
+
+# upper bounds of the request latency buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# upper bounds of the queries per request buckets
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    """Histogram
+        cumulative histogram of observations in the Prometheus sense, with their count and sum
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class RequestMetrics:
+    """RequestMetrics
+        in-process registry of the metrics of the requests served, labelled by route and method, rendered in the
+        Prometheus text exposition format. every process keeps its own metrics, the processes of a server being
+        scraped separately.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations = defaultdict(lambda: Histogram(DURATION_BUCKETS))
+        self._queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+        self._totals = defaultdict(lambda: defaultdict(float))
+
+    def observe(self, route, method, status, duration, queries, db_time, serialize_time, render_time,
+                response_size):
+        labels = (route, method)
+        with self._lock:
+            self._durations[labels].observe(duration)
+            self._queries[labels].observe(queries)
+            totals = self._totals[labels]
+            totals['db_seconds'] += db_time
+            totals['serialize_seconds'] += serialize_time
+            totals['render_seconds'] += render_time
+            totals['response_bytes'] += response_size or 0
+            self._totals[(route, method, str(status))]['requests'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._durations.clear()
+            self._queries.clear()
+            self._totals.clear()
+
+    def render(self):
+        """:return str: the metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            lines += self._render_histogram('telemetry_request_duration_seconds', 'Latency of the requests',
+                                            self._durations)
+            lines += self._render_histogram('telemetry_request_db_queries', 'SQL queries run per request',
+                                            self._queries)
+            for name, help_text, label_names in [
+                ('requests', 'Requests served', ('route', 'method', 'status')),
+                ('db_seconds', 'Time spent running SQL queries', ('route', 'method')),
+                ('serialize_seconds', 'Time spent serializing the response data', ('route', 'method')),
+                ('render_seconds', 'Time spent rendering responses', ('route', 'method')),
+                ('response_bytes', 'Size of the responses', ('route', 'method')),
+            ]:
+                lines.append(f'# HELP telemetry_request_{name}_total {help_text}')
+                lines.append(f'# TYPE telemetry_request_{name}_total counter')
+                for labels, totals in sorted(self._totals.items()):
+                    if len(labels) == len(label_names) and name in totals:
+                        lines.append(f'telemetry_request_{name}_total{format_labels(zip(label_names, labels))} '
+                                     f'{format_value(totals[name])}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _render_histogram(name, help_text, histograms):
+        lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for (route, method), histogram in sorted(histograms.items()):
+            labels = [('route', route), ('method', method)]
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f'{name}_bucket{format_labels(labels + [("le", f"{bound:g}")])} {count}')
+            lines.append(f'{name}_bucket{format_labels(labels + [("le", "+Inf")])} {histogram.count}')
+            lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(histogram.sum)}')
+        return lines
+
+
+def format_value(value):
+    """:return str: the [value] formatted as a Prometheus sample value without losing precision, so that the
+    counters never appear to stall or jump back"""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def format_labels(labels):
+    """:return str: the [labels] formatted as a Prometheus label set, their values escaped"""
+    escaped = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,118 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+
+from telemetry.metrics import request_metrics
+
+logger = logging.getLogger('api')
+
+
+class QueryRecorder:
+    """QueryRecorder
+        database execute wrapper counting the queries run and the time spent running them
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+class SerializeTimeMixin:
+    """SerializeTimeMixin
+        view mixin recording the time its serializers spend representing the response data (to_representation,
+        the queries it runs included) as the serialize time of the request reported by RequestMetricsMiddleware
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        # the schema generation inspects the view without a request
+        request = getattr(getattr(self, 'request', None), '_request', None)
+        if request is None:
+            return serializer
+
+        to_representation = serializer.to_representation
+
+        def timed_to_representation(instance):
+            started = time.perf_counter()
+            try:
+                return to_representation(instance)
+            finally:
+                request.serialize_time = getattr(request, 'serialize_time', 0) + time.perf_counter() - started
+
+        serializer.to_representation = timed_to_representation
+        return serializer
+
+
+class RequestMetricsMiddleware:
+    """RequestMetricsMiddleware
+        records the latency, number of SQL queries, time spent in the database, time spent serializing the
+        response data (in the views using SerializeTimeMixin), time spent rendering the response and size of the
+        response of every request, and:
+        - logs them as structured fields of a record of the api logger
+        - adds them to the request metrics served by the metrics endpoint, per route
+        - returns them in the Server-Timing and X-DB-Queries headers
+        the serializing, the rendering and the size of streamed responses, which happen once the response has been
+        returned, are not recorded.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        recorder = QueryRecorder()
+        request.serialize_time = 0
+        request.render_time = 0
+
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+
+        duration = time.perf_counter() - started
+        resolver_match = getattr(request, 'resolver_match', None)
+        route = resolver_match.view_name if resolver_match is not None else 'unresolved'
+        if route == 'metrics':
+            return response
+
+        response_size = None if response.streaming else len(response.content)
+        request_metrics.observe(route, request.method, response.status_code, duration, recorder.count,
+                                recorder.duration, request.serialize_time, request.render_time, response_size)
+
+        fields = {
+            'route': route,
+            'method': request.method,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 3),
+            'db_queries': recorder.count,
+            'db_time_ms': round(recorder.duration * 1000, 3),
+            'serialize_time_ms': round(request.serialize_time * 1000, 3),
+            'render_time_ms': round(request.render_time * 1000, 3),
+            'response_bytes': response_size,
+        }
+        logger.info(' '.join(f'{name}={value}' for name, value in fields.items()), extra=fields)
+
+        response['X-DB-Queries'] = str(recorder.count)
+        response['Server-Timing'] = f'db;dur={fields["db_time_ms"]}, serialize;dur={fields["serialize_time_ms"]}, ' \
+                                    f'render;dur={fields["render_time_ms"]}, total;dur={fields["duration_ms"]}'
+        return response
+
+    def process_template_response(self, request, response):
+        # rest framework responses are rendered right after this hook, the rendering ending with their callbacks
+        started = time.perf_counter()
+
+        def record_render_time(rendered):
+            request.render_time = time.perf_counter() - started
+
+        response.add_post_render_callback(record_render_time)
+        return response
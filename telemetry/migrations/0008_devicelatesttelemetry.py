@@ -0,0 +1,128 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:07
+
+from collections import Counter
+from datetime import datetime
+
+from django.db import migrations, models
+from django.utils import timezone
+import django.db.models.deletion
+import uuid
+
+# copies of the helpers of telemetry.models at the time of this migration, which must not follow their changes
+TIME_AND_DATE_DIMENSION = 'Time Point (time & date)'
+DATE_DIMENSION = 'Time Point (date)'
+TIME_POINT_DIMENSIONS = (TIME_AND_DATE_DIMENSION, DATE_DIMENSION)
+TIME_POINT_FORMAT = "%Y-%m-%dT%H:%M:%S.000000"
+
+
+def parse_time_point(value):
+    """:return datetime: the time point [value] sent by the gateway as an aware datetime in UTC or None if it is not
+    a valid time point"""
+    try:
+        return timezone.make_aware(datetime.strptime(value, TIME_POINT_FORMAT), timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_dominant_dimension(dimensions):
+    """:return str: the dimension which appears the most in [dimensions], an iterable of dimensions or a mapping of
+    dimension to count, a measurement dimension being preferred to a time point dimension on a tie, then the first
+    one alphabetically"""
+    counter = Counter(dimensions)
+    if not counter:
+        return None
+
+    return min(counter, key=lambda dimension: (-counter[dimension], dimension in TIME_POINT_DIMENSIONS, dimension))
+
+
+def summarize_values(values):
+    """:return dict(latest_date, latest_value, due_date, due_value, dimension): the newest measurement of a message,
+    at the storagenr of its latest "Time Point (time & date)" value, and its due date measurement, at the storagenr
+    of its latest "Time Point (date)" value, or None when it has no valid "Time Point (time & date)" value"""
+    values = list(values)
+    dimension = get_dominant_dimension(value.dimension for value in values) if values else None
+
+    measurements = {}
+    latest = due = None
+    for value in values:
+        if value.dimension == dimension:
+            measurements.setdefault(value.storagenr, value.value)
+        if value.dimension in TIME_POINT_DIMENSIONS:
+            date = parse_time_point(value.value)
+            if date is None:
+                continue
+            if value.dimension == TIME_AND_DATE_DIMENSION and (latest is None or date > latest[0]):
+                latest = (date, value.storagenr)
+            if value.dimension == DATE_DIMENSION and (due is None or date > due[0]):
+                due = (date, value.storagenr)
+
+    if latest is None:
+        return None
+
+    return {
+        'latest_date': latest[0],
+        'latest_value': measurements.get(latest[1]),
+        'due_date': due[0] if due else None,
+        'due_value': measurements.get(due[1]) if due else None,
+        'dimension': dimension,
+    }
+
+
+def backfill_latest_telemetry(apps, schema_editor):
+    """computes the latest state of every device that has already sent messages"""
+    Device = apps.get_model('telemetry', 'Device')
+    Value = apps.get_model('telemetry', 'Value')
+    DeviceLatestTelemetry = apps.get_model('telemetry', 'DeviceLatestTelemetry')
+
+    latest_telemetry = []
+    for device_id in Device.objects.values_list('id', flat=True).iterator():
+        time_points = Value.objects.filter(message__device_id=device_id, dimension=TIME_AND_DATE_DIMENSION) \
+            .values_list('value', 'message_id')
+        dates = [(parse_time_point(value), message_id) for value, message_id in time_points.iterator()]
+        dates = [(date, message_id) for date, message_id in dates if date is not None]
+        if not dates:
+            continue
+
+        _, message_id = max(dates)
+        summary = summarize_values(Value.objects.filter(message_id=message_id))
+        latest_telemetry.append(DeviceLatestTelemetry(device_id=device_id, message_id=message_id, **summary))
+
+        if len(latest_telemetry) >= 1000:
+            DeviceLatestTelemetry.objects.bulk_create(latest_telemetry)
+            latest_telemetry = []
+
+    DeviceLatestTelemetry.objects.bulk_create(latest_telemetry)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry', '0007_auto_20200705_1008'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceLatestTelemetry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uuid', models.UUIDField(db_index=True, default=uuid.uuid4, editable=False, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('deleted_at', models.DateTimeField(blank=True, null=True)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('latest_date', models.DateTimeField()),
+                ('latest_value', models.CharField(blank=True, max_length=50, null=True)),
+                ('due_date', models.DateTimeField(blank=True, null=True)),
+                ('due_value', models.CharField(blank=True, max_length=50, null=True)),
+                ('dimension', models.CharField(max_length=50)),
+                ('device', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='latest_telemetry', to='telemetry.Device')),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='telemetry.Message')),
+            ],
+            options={
+                'verbose_name': 'Device Latest Telemetry',
+                'verbose_name_plural': 'Devices Latest Telemetry',
+                'ordering': ['uuid'],
+            },
+        ),
+        migrations.RunPython(backfill_latest_telemetry, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:09
+
+import math
+from datetime import datetime
+
+from django.db import migrations, models
+from django.utils import timezone
+
+# copies of the helpers of telemetry.models at the time of this migration, which must not follow their changes
+TIME_POINT_DIMENSIONS = ('Time Point (time & date)', 'Time Point (date)')
+TIME_POINT_FORMAT = "%Y-%m-%dT%H:%M:%S.000000"
+
+
+def parse_time_point(value):
+    """:return datetime: the time point [value] sent by the gateway as an aware datetime in UTC or None if it is not
+    a valid time point"""
+    try:
+        return timezone.make_aware(datetime.strptime(value, TIME_POINT_FORMAT), timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_measurement(value):
+    """:return float: the measured [value] sent by the gateway or None if it is not numeric"""
+    try:
+        measurement = float(value)
+    except (TypeError, ValueError):
+        return None
+    return measurement if math.isfinite(measurement) else None
+
+
+def backfill_typed_columns(apps, schema_editor):
+    """parses the raw value of the existing values into their typed columns in batches"""
+    Value = apps.get_model('telemetry', 'Value')
+
+    last_id = 0
+    while True:
+        values = list(Value.objects.filter(id__gt=last_id).order_by('id').only('id', 'value', 'dimension')[:5000])
+        if not values:
+            break
+
+        for value in values:
+            if value.dimension in TIME_POINT_DIMENSIONS:
+                value.time_point = parse_time_point(value.value)
+            else:
+                value.measurement = parse_measurement(value.value)
+
+        Value.objects.bulk_update(values, ['time_point', 'measurement'])
+        last_id = values[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry', '0008_devicelatesttelemetry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='value',
+            name='measurement',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='value',
+            name='time_point',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(backfill_typed_columns, migrations.RunPython.noop),
+    ]
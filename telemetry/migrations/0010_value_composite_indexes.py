@@ -0,0 +1,31 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry', '0009_value_typed_columns'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='value',
+            name='storagenr',
+            field=models.PositiveIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='value',
+            name='time_point',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='value',
+            index=models.Index(fields=['message', 'dimension', 'storagenr'], name='value_msg_dim_storagenr_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='value',
+            index=models.Index(condition=models.Q(time_point__isnull=False), fields=['dimension', '-time_point', 'message'], name='value_time_point_idx'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+from django.db import migrations
+
+# the value table is converted into a table partitioned by month of [created_at], every row being moved to the
+# default partition first. monthly partitions are then created (and split out of the default partition) by the
+# telemetry_partitions management command. a partitioned table requires its primary key and unique constraints
+# to include the partition key, so they become (id, created_at) and (uuid, created_at).
+# as every row is copied, this migration should be run during a maintenance window on large databases.
+PARTITION_VALUE_TABLE = """
+    CREATE TABLE telemetry_value_partitioned (LIKE telemetry_value INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+        PARTITION BY RANGE (created_at);
+    CREATE TABLE telemetry_value_default PARTITION OF telemetry_value_partitioned DEFAULT;
+    INSERT INTO telemetry_value_partitioned SELECT * FROM telemetry_value;
+
+    ALTER SEQUENCE telemetry_value_id_seq OWNED BY NONE;
+    DROP TABLE telemetry_value;
+    ALTER TABLE telemetry_value_partitioned RENAME TO telemetry_value;
+    ALTER SEQUENCE telemetry_value_id_seq OWNED BY telemetry_value.id;
+
+    ALTER TABLE telemetry_value ADD CONSTRAINT telemetry_value_pkey PRIMARY KEY (id, created_at);
+    ALTER TABLE telemetry_value ADD CONSTRAINT telemetry_value_uuid_key UNIQUE (uuid, created_at);
+    ALTER TABLE telemetry_value ADD CONSTRAINT telemetry_value_message_id_47a132da_fk_telemetry_message_id
+        FOREIGN KEY (message_id) REFERENCES telemetry_message (id) DEFERRABLE INITIALLY DEFERRED;
+    CREATE INDEX telemetry_value_message_id_47a132da ON telemetry_value (message_id);
+    CREATE INDEX telemetry_value_dimension_810554ab ON telemetry_value (dimension);
+    CREATE INDEX telemetry_value_dimension_810554ab_like ON telemetry_value (dimension varchar_pattern_ops);
+    CREATE INDEX value_msg_dim_storagenr_idx ON telemetry_value (message_id, dimension, storagenr);
+    CREATE INDEX value_time_point_idx ON telemetry_value (dimension, time_point DESC, message_id)
+        WHERE time_point IS NOT NULL;
+"""
+
+UNPARTITION_VALUE_TABLE = """
+    CREATE TABLE telemetry_value_unpartitioned (LIKE telemetry_value INCLUDING DEFAULTS INCLUDING CONSTRAINTS);
+    INSERT INTO telemetry_value_unpartitioned SELECT * FROM telemetry_value;
+
+    ALTER SEQUENCE telemetry_value_id_seq OWNED BY NONE;
+    DROP TABLE telemetry_value;
+    ALTER TABLE telemetry_value_unpartitioned RENAME TO telemetry_value;
+    ALTER SEQUENCE telemetry_value_id_seq OWNED BY telemetry_value.id;
+
+    ALTER TABLE telemetry_value ADD CONSTRAINT telemetry_value_pkey PRIMARY KEY (id);
+    ALTER TABLE telemetry_value ADD CONSTRAINT telemetry_value_uuid_key UNIQUE (uuid);
+    ALTER TABLE telemetry_value ADD CONSTRAINT telemetry_value_message_id_47a132da_fk_telemetry_message_id
+        FOREIGN KEY (message_id) REFERENCES telemetry_message (id) DEFERRABLE INITIALLY DEFERRED;
+    CREATE INDEX telemetry_value_message_id_47a132da ON telemetry_value (message_id);
+    CREATE INDEX telemetry_value_dimension_810554ab ON telemetry_value (dimension);
+    CREATE INDEX telemetry_value_dimension_810554ab_like ON telemetry_value (dimension varchar_pattern_ops);
+    CREATE INDEX value_msg_dim_storagenr_idx ON telemetry_value (message_id, dimension, storagenr);
+    CREATE INDEX value_time_point_idx ON telemetry_value (dimension, time_point DESC, message_id)
+        WHERE time_point IS NOT NULL;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry', '0010_value_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(PARTITION_VALUE_TABLE, UNPARTITION_VALUE_TABLE),
+    ]
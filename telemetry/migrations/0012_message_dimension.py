@@ -0,0 +1,126 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:14
+
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from django.db import migrations, models
+from django.utils import timezone
+
+# copies of the helpers of telemetry.models at the time of this migration, which must not follow their changes
+TIME_AND_DATE_DIMENSION = 'Time Point (time & date)'
+DATE_DIMENSION = 'Time Point (date)'
+TIME_POINT_DIMENSIONS = (TIME_AND_DATE_DIMENSION, DATE_DIMENSION)
+TIME_POINT_FORMAT = "%Y-%m-%dT%H:%M:%S.000000"
+
+
+def parse_time_point(value):
+    """:return datetime: the time point [value] sent by the gateway as an aware datetime in UTC or None if it is not
+    a valid time point"""
+    try:
+        return timezone.make_aware(datetime.strptime(value, TIME_POINT_FORMAT), timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_dominant_dimension(dimensions):
+    """:return str: the dimension which appears the most in [dimensions], an iterable of dimensions or a mapping of
+    dimension to count, a measurement dimension being preferred to a time point dimension on a tie, then the first
+    one alphabetically"""
+    counter = Counter(dimensions)
+    if not counter:
+        return None
+
+    return min(counter, key=lambda dimension: (-counter[dimension], dimension in TIME_POINT_DIMENSIONS, dimension))
+
+
+def summarize_values(values):
+    """:return dict(latest_date, latest_value, due_date, due_value, dimension): the newest measurement of a message,
+    at the storagenr of its latest "Time Point (time & date)" value, and its due date measurement, at the storagenr
+    of its latest "Time Point (date)" value, or None when it has no valid "Time Point (time & date)" value"""
+    values = list(values)
+    dimension = get_dominant_dimension(value.dimension for value in values) if values else None
+
+    measurements = {}
+    latest = due = None
+    for value in values:
+        if value.dimension == dimension:
+            measurements.setdefault(value.storagenr, value.value)
+        if value.dimension in TIME_POINT_DIMENSIONS:
+            date = parse_time_point(value.value)
+            if date is None:
+                continue
+            if value.dimension == TIME_AND_DATE_DIMENSION and (latest is None or date > latest[0]):
+                latest = (date, value.storagenr)
+            if value.dimension == DATE_DIMENSION and (due is None or date > due[0]):
+                due = (date, value.storagenr)
+
+    if latest is None:
+        return None
+
+    return {
+        'latest_date': latest[0],
+        'latest_value': measurements.get(latest[1]),
+        'due_date': due[0] if due else None,
+        'due_value': measurements.get(due[1]) if due else None,
+        'dimension': dimension,
+    }
+
+
+def backfill_dimension(apps, schema_editor):
+    """stores the most common dimension of the existing messages, computed with one aggregate query per batch,
+    then recomputes the latest telemetry of the devices which was computed with the wrong dimension"""
+    Message = apps.get_model('telemetry', 'Message')
+    Value = apps.get_model('telemetry', 'Value')
+    DeviceLatestTelemetry = apps.get_model('telemetry', 'DeviceLatestTelemetry')
+
+    last_id = 0
+    while True:
+        messages = list(Message.objects.filter(id__gt=last_id).order_by('id').only('id')[:5000])
+        if not messages:
+            break
+
+        counts = defaultdict(dict)
+        for message_id, dimension, count in Value.objects.filter(message_id__in=[m.id for m in messages]) \
+                .order_by().values_list('message_id', 'dimension').annotate(count=models.Count('id')):
+            counts[message_id][dimension] = count
+        for message in messages:
+            message.dimension = get_dominant_dimension(counts[message.id])
+
+        Message.objects.bulk_update(messages, ['dimension'])
+        last_id = messages[-1].id
+
+    last_id = 0
+    while True:
+        latest_telemetry = list(DeviceLatestTelemetry.objects.filter(id__gt=last_id).order_by('id')[:1000])
+        if not latest_telemetry:
+            break
+
+        values = defaultdict(list)
+        for value in Value.objects.filter(message_id__in=[latest.message_id for latest in latest_telemetry]):
+            values[value.message_id].append(value)
+        for latest in latest_telemetry:
+            summary = summarize_values(values[latest.message_id])
+            if summary is not None:
+                for field, value in summary.items():
+                    setattr(latest, field, value)
+
+        DeviceLatestTelemetry.objects.bulk_update(
+            latest_telemetry, ['latest_date', 'latest_value', 'due_date', 'due_value', 'dimension']
+        )
+        last_id = latest_telemetry[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry', '0011_partition_value'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='dimension',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.RunPython(backfill_dimension, migrations.RunPython.noop),
+    ]
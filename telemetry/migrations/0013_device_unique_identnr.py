@@ -0,0 +1,45 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:15
+
+from django.db import migrations, models
+
+
+def merge_duplicate_devices(apps, schema_editor):
+    """merges the devices sharing the same [identnr] into the first one created before [identnr] becomes unique.
+    their messages are moved to the kept device, which keeps the most recent of their latest telemetry"""
+    Device = apps.get_model('telemetry', 'Device')
+    Message = apps.get_model('telemetry', 'Message')
+    DeviceLatestTelemetry = apps.get_model('telemetry', 'DeviceLatestTelemetry')
+
+    duplicates = Device.objects.values('identnr').annotate(count=models.Count('id'), kept_id=models.Min('id')) \
+        .filter(count__gt=1).order_by()
+    for duplicate in duplicates.iterator():
+        device_ids = list(Device.objects.filter(identnr=duplicate['identnr']).values_list('id', flat=True))
+        merged_ids = [device_id for device_id in device_ids if device_id != duplicate['kept_id']]
+
+        latest_telemetry = list(DeviceLatestTelemetry.objects.filter(device_id__in=device_ids))
+        if latest_telemetry:
+            latest = max(latest_telemetry, key=lambda latest: latest.latest_date)
+            DeviceLatestTelemetry.objects.filter(device_id__in=device_ids).exclude(id=latest.id).delete()
+            DeviceLatestTelemetry.objects.filter(id=latest.id).update(device_id=duplicate['kept_id'])
+
+        Message.objects.filter(device_id__in=merged_ids).update(device_id=duplicate['kept_id'])
+        Device.objects.filter(id__in=merged_ids).delete()
+
+    # check the deferred foreign keys now, the table cannot be altered with pending trigger events
+    schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry', '0012_message_dimension'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_devices, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='device',
+            name='identnr',
+            field=models.PositiveIntegerField(unique=True),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:16
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry', '0013_device_unique_identnr'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uuid', models.UUIDField(db_index=True, default=uuid.uuid4, editable=False, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('deleted_at', models.DateTimeField(blank=True, null=True)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('payload', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Queued Message',
+                'verbose_name_plural': 'Queued Messages',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='queuedmessage',
+            index=models.Index(fields=['status', 'id'], name='queuedmessage_status_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry', '0014_queuedmessage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['-created_at'], name='message_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['device', '-created_at'], name='message_device_created_idx'),
+        ),
+    ]
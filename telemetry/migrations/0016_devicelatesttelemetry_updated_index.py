@@ -0,0 +1,17 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry', '0015_message_created_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='devicelatesttelemetry',
+            index=models.Index(fields=['updated_at'], name='latest_telemetry_updated_idx'),
+        ),
+    ]
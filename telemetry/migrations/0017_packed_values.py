@@ -0,0 +1,40 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:31
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry', '0016_devicelatesttelemetry_updated_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Dimension',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+            ],
+            options={
+                'verbose_name': 'Dimension',
+                'verbose_name_plural': 'Dimensions',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='packed_values',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='latest_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('is_deleted', False), ('latest_date__isnull', False), ('packed_values__isnull', False)), fields=['device', '-latest_date'], name='message_packed_latest_idx'),
+        ),
+    ]
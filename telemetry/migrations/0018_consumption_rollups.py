@@ -0,0 +1,69 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry', '0017_packed_values'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyConsumption',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uuid', models.UUIDField(db_index=True, default=uuid.uuid4, editable=False, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('deleted_at', models.DateTimeField(blank=True, null=True)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('period', models.DateField()),
+                ('readings', models.PositiveIntegerField(default=0)),
+                ('first_date', models.DateTimeField(blank=True, null=True)),
+                ('first_value', models.FloatField(blank=True, null=True)),
+                ('last_date', models.DateTimeField(blank=True, null=True)),
+                ('last_value', models.FloatField(blank=True, null=True)),
+                ('min_value', models.FloatField(blank=True, null=True)),
+                ('max_value', models.FloatField(blank=True, null=True)),
+                ('delta', models.FloatField(blank=True, null=True)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='telemetry.Device')),
+            ],
+            options={
+                'verbose_name': 'Monthly Consumption',
+                'verbose_name_plural': 'Monthly Consumptions',
+                'ordering': ['uuid'],
+                'unique_together': {('device', 'period')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyConsumption',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uuid', models.UUIDField(db_index=True, default=uuid.uuid4, editable=False, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('deleted_at', models.DateTimeField(blank=True, null=True)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('period', models.DateField()),
+                ('readings', models.PositiveIntegerField(default=0)),
+                ('first_date', models.DateTimeField(blank=True, null=True)),
+                ('first_value', models.FloatField(blank=True, null=True)),
+                ('last_date', models.DateTimeField(blank=True, null=True)),
+                ('last_value', models.FloatField(blank=True, null=True)),
+                ('min_value', models.FloatField(blank=True, null=True)),
+                ('max_value', models.FloatField(blank=True, null=True)),
+                ('delta', models.FloatField(blank=True, null=True)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='telemetry.Device')),
+            ],
+            options={
+                'verbose_name': 'Daily Consumption',
+                'verbose_name_plural': 'Daily Consumptions',
+                'ordering': ['uuid'],
+                'unique_together': {('device', 'period')},
+            },
+        ),
+    ]
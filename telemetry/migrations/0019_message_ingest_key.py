@@ -0,0 +1,22 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry', '0018_consumption_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='ingest_key',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('ingest_key',), name='message_ingest_key_unique'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry', '0019_message_ingest_key'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_device_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='value',
+            name='value_msg_dim_storagenr_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='value',
+            name='value_time_point_idx',
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(condition=models.Q(is_deleted=True), fields=['deleted_at'], name='device_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(is_deleted=False), fields=['-created_at'], name='message_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(is_deleted=False), fields=['device', '-created_at'], name='message_device_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(is_deleted=True), fields=['deleted_at'], name='message_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='value',
+            index=models.Index(condition=models.Q(is_deleted=False), fields=['message', 'dimension', 'storagenr'], name='value_msg_dim_storagenr_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='value',
+            index=models.Index(condition=models.Q(('is_deleted', False), ('time_point__isnull', False)), fields=['dimension', '-time_point', 'message'], name='value_time_point_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='value',
+            index=models.Index(condition=models.Q(is_deleted=True), fields=['deleted_at'], name='value_deleted_idx'),
+        ),
+    ]
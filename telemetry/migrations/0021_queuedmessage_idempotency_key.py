@@ -0,0 +1,18 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telemetry', '0020_soft_delete_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuedmessage',
+            name='idempotency_key',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -1,10 +1,130 @@
+import hashlib
+import json
+import math
 import uuid
-from collections import Counter
+from collections import Counter, defaultdict
 from datetime import datetime
+from itertools import groupby
 
-from django.db import models
+from django.contrib.postgres.fields import JSONField
+from django.db import connection, models, transaction
 from django.utils import timezone
 
+from telemetry.cache import device_cache, export_cache
+
+TIME_AND_DATE_DIMENSION = 'Time Point (time & date)'
+DATE_DIMENSION = 'Time Point (date)'
+TIME_POINT_DIMENSIONS = (TIME_AND_DATE_DIMENSION, DATE_DIMENSION)
+TIME_POINT_FORMAT = "%Y-%m-%dT%H:%M:%S.000000"
+
+
+def parse_time_point(value):
+    """parse_time_point
+        parses a time point value sent by the gateway
+        :return datetime: aware datetime in UTC or None if the value is not a valid time point
+    """
+    try:
+        return timezone.make_aware(datetime.strptime(value, TIME_POINT_FORMAT), timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_measurement(value):
+    """parse_measurement
+        parses a measured value sent by the gateway
+        :return float: the measurement or None if the value is not numeric
+    """
+    try:
+        measurement = float(value)
+    except (TypeError, ValueError):
+        return None
+    return measurement if math.isfinite(measurement) else None
+
+
+def get_dominant_dimension(dimensions):
+    """get_dominant_dimension
+        returns the dimension that appears the most, a measurement dimension being preferred to a time point
+        dimension on a tie, then the first one alphabetically
+        :param dimensions: iterable of the dimensions of a message's values or mapping of dimension to count
+        :return dimension: str the dimension to be used as the dimension of a message's values
+    """
+    counter = Counter(dimensions)
+    if not counter:
+        return None
+
+    return min(counter, key=lambda dimension: (-counter[dimension], dimension in TIME_POINT_DIMENSIONS, dimension))
+
+
+def summarize_values(values):
+    """summarize_values
+        computes the newest measurement and the due date measurement of a message from its values
+        - the newest measurement is at the storagenr of the latest "Time Point (time & date)" value
+        - the due date measurement is at the storagenr of the latest "Time Point (date)" value
+
+        :return dict(latest_date, latest_value, due_date, due_value, dimension) or None when the message
+         has no valid "Time Point (time & date)" value
+    """
+    values = list(values)
+    dimension = get_dominant_dimension(value.dimension for value in values) if values else None
+
+    measurements = {}
+    latest = due = None
+    for value in values:
+        if value.dimension == dimension:
+            measurements.setdefault(value.storagenr, value.value)
+        if value.dimension in (TIME_AND_DATE_DIMENSION, DATE_DIMENSION):
+            date = parse_time_point(value.value)
+            if date is None:
+                continue
+            if value.dimension == TIME_AND_DATE_DIMENSION and (latest is None or date > latest[0]):
+                latest = (date, value.storagenr)
+            if value.dimension == DATE_DIMENSION and (due is None or date > due[0]):
+                due = (date, value.storagenr)
+
+    if latest is None:
+        return None
+
+    return {
+        'latest_date': latest[0],
+        'latest_value': measurements.get(latest[1]),
+        'due_date': due[0] if due else None,
+        'due_value': measurements.get(due[1]) if due else None,
+        'dimension': dimension,
+    }
+
+
+class SoftDeleteQuerySet(models.QuerySet):
+    """queryset of the models which are soft deleted"""
+
+    def soft_delete(self):
+        """soft deletes the rows of the queryset with a single update. the update sends no post_save signal, so
+        soft deleted devices are dropped from the device cache and their exports invalidated here, and the devices
+        of soft deleted messages are refreshed (see refresh_devices)
+            :return int: number of rows soft deleted
+        """
+        identnrs = list(self.values_list('identnr', flat=True)) if issubclass(self.model, Device) else []
+        device_ids = list(self.order_by().values_list('device_id', flat=True).distinct()) \
+            if issubclass(self.model, Message) else []
+        with transaction.atomic():
+            deleted = self.update(deleted_at=timezone.now(), is_deleted=True)
+            refresh_devices(device_ids)
+        for identnr in identnrs:
+            device_cache.invalidate(identnr)
+        export_cache.invalidate(identnrs)
+        return deleted
+
+
+class SoftDeleteManager(models.Manager.from_queryset(SoftDeleteQuerySet)):
+    """SoftDeleteManager
+        default manager of the application models, which leaves out the soft deleted rows. the rows of the other
+        models related to a soft deleted row are not soft deleted with it.
+        the soft deleted rows are kept until the purge_deleted command removes them, and can be reached through
+        the `all_objects` manager
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(is_deleted=False)
+
 
 class BaseModel(models.Model):
     """abstract base model to be inherited by other application models"""
@@ -12,6 +132,9 @@ class BaseModel(models.Model):
     class Meta:
         abstract = True
 
+    objects = SoftDeleteManager()
+    all_objects = models.Manager.from_queryset(SoftDeleteQuerySet)()
+
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -24,11 +147,40 @@ class BaseModel(models.Model):
         self.save()
 
 
+def get_ingest_key(identnr, values, idempotency_key=None):
+    """get_ingest_key
+        key identifying a gateway message so that its retransmissions are stored once: the idempotency key
+        supplied by the client for the device when there is one, or else a hash of the device and of all the
+        records of the message, which include its time point
+        :param values: iterable of dict(value, tariff, subunit, dimension, storagenr), the records of the message
+        :return str: hex digest of the key
+    """
+    if idempotency_key is not None:
+        content = ['idempotency-key', identnr, idempotency_key]
+    else:
+        content = [identnr, sorted([value['value'], value['tariff'], value['subunit'], value['dimension'],
+                                    value['storagenr']] for value in values)]
+    return hashlib.sha256(json.dumps(content).encode()).hexdigest()
+
+
+def get_reading(values):
+    """get_reading
+        the reading of a message is its newest measurement, at the storagenr of its latest
+        "Time Point (time & date)" value
+        :return tuple(date: datetime, measurement: float) or None when the message has no numeric newest measurement
+    """
+    summary = summarize_values(values)
+    if summary is None:
+        return None
+    measurement = parse_measurement(summary['latest_value'])
+    return (summary['latest_date'], measurement) if measurement is not None else None
+
+
 class Device(BaseModel):
     """Device model"""
     device_type = models.PositiveIntegerField(null=True, blank=True)
     status = models.PositiveIntegerField(default=0)
-    identnr = models.PositiveIntegerField(db_index=True)
+    identnr = models.PositiveIntegerField(unique=True)
     version = models.PositiveIntegerField(default=0)
     accessnr = models.PositiveIntegerField(default=0)
     manufacturer = models.PositiveIntegerField(default=0)
@@ -37,12 +189,18 @@ class Device(BaseModel):
         ordering = ['uuid', 'identnr']
         verbose_name = 'Device'
         verbose_name_plural = 'Devicies'
+        indexes = [
+            # soft deleted devices past their retention, for the purge_deleted command
+            models.Index(fields=['deleted_at'], name='device_deleted_idx', condition=models.Q(is_deleted=True)),
+        ]
 
     def get_latest_device_message_and_date(self):
         """ get_latest_device_message_and_date
-            - returns all messages related to a device
-            - compares values of the messages' data who's dimensions are exactly "Time Point (time & date)"
-              which are representing latest date of measurement
+            - finds the device's value with the latest parsed time point whose dimension is exactly
+              "Time Point (time & date)", which is representing latest date of measurement
+            - the ordering is done by the database on the typed time point column
+            - the latest state maintained at ingest is used when the device has one, which also covers the
+              messages whose values are packed
 
             :return tuple(message: message, value: int, date: datetime)
              message: latest message
@@ -50,39 +208,46 @@ class Device(BaseModel):
              date: date for the latest measurement
         """
 
-        if self.messages is not None and self.messages.count() > 0:
-            msgs = list(self.messages.filter(data__dimension__exact='Time Point (time & date)')
-                        .values('uuid', 'data__storagenr', 'data__value').all())
-            latest_msg = max(msgs, key=lambda m: datetime.strptime(m['data__value'], "%Y-%m-%dT%H:%M:%S.000000"))
-            message = Message.objects.get(uuid=latest_msg['uuid'])
-            latest_value = message.data.filter(storagenr=latest_msg['data__storagenr'],
-                                               dimension__exact=message.get_dimension()) \
-                .values_list('value').first()[0]
-            return message, latest_value, datetime.strptime(latest_msg['data__value'], "%Y-%m-%dT%H:%M:%S.000000")
+        state = DeviceLatestTelemetry.objects.filter(device=self, message__is_deleted=False) \
+            .select_related('message').first()
+        if state is not None:
+            return state.message, state.latest_value, state.latest_date
+
+        latest = Value.objects.filter(message__device=self, message__is_deleted=False,
+                                      dimension__exact=TIME_AND_DATE_DIMENSION, time_point__isnull=False) \
+            .select_related('message').order_by('-time_point').first()
+        if latest is not None:
+            message = latest.message
+            latest_value = message.data.filter(storagenr=latest.storagenr, dimension__exact=message.get_dimension()) \
+                .values_list('value', flat=True).first()
+            return message, latest_value, latest.time_point
         return None
 
     def get_latest_message_due_date_and_due_date_measurement(self):
         """ get_latest_message_due_date_and_due_date_measurement
             - return the latest message.
-            - get all values related to the message whose dimensions are exactly "Time Point (date)".
-            - get the due date by comparing it the date of the latest measurement and
-              returning the earliest from it.
+            - get the value related to the message whose dimension is exactly "Time Point (date)"
+              with the latest parsed time point, which is the due date.
 
           :return tuple(due_value: int, due_date: datetime)
             value: value for measurement at due date
             date: date of the due date
         """
 
-        n = None if self.get_latest_device_message_and_date() is None \
-            else self.get_latest_device_message_and_date()
+        state = DeviceLatestTelemetry.objects.filter(device=self, message__is_deleted=False).first()
+        if state is not None:
+            return (state.due_value, state.due_date) if state.due_date is not None else None
+
+        n = self.get_latest_device_message_and_date()
         if n is not None:
             message, latest_value, latest_date = n
-            values = list(message.data.filter(dimension__exact='Time Point (date)').values('storagenr', 'value').all())
-            due_data = max(values, key=lambda v: datetime.strptime(v['value'], "%Y-%m-%dT%H:%M:%S.000000"))
-            due_value = message.data.filter(storagenr=due_data['storagenr'],
-                                            dimension__exact=message.get_dimension()).values_list('value').first()[0]
-            due_date = datetime.strptime(due_data['value'], "%Y-%m-%dT%H:%M:%S.000000")
-            return due_value, due_date
+            due_data = message.data.filter(dimension__exact=DATE_DIMENSION, time_point__isnull=False) \
+                .order_by('-time_point').first()
+            if due_data is None:
+                return None
+            due_value = message.data.filter(storagenr=due_data.storagenr, dimension__exact=message.get_dimension()) \
+                .values_list('value', flat=True).first()
+            return due_value, due_data.time_point
         return n
 
     def __str__(self):
@@ -96,23 +261,100 @@ class Message(BaseModel):
     """
     # many messages are related one device
     device = models.ForeignKey("telemetry.Device", on_delete=models.CASCADE, related_name='messages')
+    # dimension that appears the most in the message's data, computed at ingest
+    dimension = models.CharField(max_length=50, null=True, blank=True)
+    # values of the message in the packed storage mode, stored in this row instead of as Value rows:
+    # a list of [value, tariff, subunit, dimension id, storagenr], the dimensions being interned in Dimension
+    packed_values = JSONField(null=True, blank=True)
+    # latest "Time Point (time & date)" of the packed values, which the database cannot read from them
+    latest_date = models.DateTimeField(null=True, blank=True)
+    # key deduplicating the retransmissions of the message, see get_ingest_key
+    ingest_key = models.CharField(max_length=64, null=True, blank=True)
 
     class Meta:
         ordering = ['uuid']
         verbose_name = 'Message'
         verbose_name_plural = 'Messages'
+        indexes = [
+            # listing of the messages from the most recent ones, of all devices or of a device. the indexes
+            # only cover the rows which are not soft deleted, which are the only ones the default manager reads
+            models.Index(fields=['-created_at'], name='message_created_idx', condition=models.Q(is_deleted=False)),
+            models.Index(fields=['device', '-created_at'], name='message_device_created_idx',
+                         condition=models.Q(is_deleted=False)),
+            # soft deleted messages past their retention, for the purge_deleted command
+            models.Index(fields=['deleted_at'], name='message_deleted_idx', condition=models.Q(is_deleted=True)),
+            # latest packed message of every device, for the rebuild of the latest telemetry
+            models.Index(fields=['device', '-latest_date'], name='message_packed_latest_idx',
+                         condition=models.Q(packed_values__isnull=False, latest_date__isnull=False,
+                                            is_deleted=False)),
+        ]
+        constraints = [
+            # a retransmitted message is found with a single probe of this index, which also rejects the
+            # retransmissions stored concurrently
+            models.UniqueConstraint(fields=['ingest_key'], name='message_ingest_key_unique'),
+        ]
 
     def get_dimension(self):
         """get_dimension
-            iterates through a messages data set and returns the dimensions that appears the most as the dimension
-            to this device
+            returns the dimension that appears the most in the message's data set as the dimension to this device.
+            it is computed at ingest, or with a single aggregate query for messages stored without it
             :return dimension: str
         """
-        counter = Counter()
-        for value in self.data.iterator():
-            counter[value.dimension] += 1
+        if self.dimension is None:
+            if self.packed_values is not None:
+                self.dimension = get_dominant_dimension(value.dimension for value in self.get_values())
+            else:
+                counts = self.data.order_by().values_list('dimension').annotate(count=models.Count('id'))
+                self.dimension = get_dominant_dimension(dict(counts))
+        return self.dimension
 
-        return max(counter)
+    @staticmethod
+    def pack_values(values, dimension_ids):
+        """pack_values
+            packs the values of a message for the packed storage mode
+            :param values: list of dict(value, tariff, subunit, dimension, storagenr) as received from the gateway
+            :param dimension_ids: dict(dimension: id) of the interned dimensions
+            :return list: the packed values
+        """
+        return [[value['value'], value['tariff'], value['subunit'], dimension_ids[value['dimension']],
+                 value['storagenr']] for value in values]
+
+    @staticmethod
+    def get_latest_date(values):
+        """get_latest_date
+            :param values: list of dict(value, tariff, subunit, dimension, storagenr) as received from the gateway
+            :return datetime: the latest valid "Time Point (time & date)" of the values or None
+        """
+        dates = [parse_time_point(value['value']) for value in values if value['dimension'] == TIME_AND_DATE_DIMENSION]
+        return max((date for date in dates if date is not None), default=None)
+
+    def unpack_values(self, dimension_names):
+        """unpack_values
+            :param dimension_names: dict(id: dimension) of the interned dimensions
+            :return list of dict(value, tariff, subunit, dimension, storagenr): the packed values of the message
+             ordered by storagenr, as the values stored as rows are
+        """
+        values = [{'value': value, 'tariff': tariff, 'subunit': subunit, 'dimension': dimension_names[dimension],
+                   'storagenr': storagenr} for value, tariff, subunit, dimension, storagenr in self.packed_values]
+        return sorted(values, key=lambda value: value['storagenr'])
+
+    def soft_delete(self):
+        with transaction.atomic():
+            super().soft_delete()
+            refresh_devices([self.device_id])
+
+    def get_values(self):
+        """:return list of Value: the values of the message, unsaved ones built from its packed values
+        when they are packed
+        """
+        if self.packed_values is None:
+            return list(self.data.all())
+
+        dimension_names = Dimension.get_names(value[3] for value in self.packed_values)
+        values = [Value(message=self, **value) for value in self.unpack_values(dimension_names)]
+        for value in values:
+            value.parse_value()
+        return values
 
     def __str__(self):
         return str(self.device)
@@ -126,12 +368,425 @@ class Value(BaseModel):
     tariff = models.PositiveIntegerField()
     subunit = models.PositiveIntegerField()
     dimension = models.CharField(max_length=50, db_index=True)
-    storagenr = models.PositiveIntegerField(db_index=True)
+    storagenr = models.PositiveIntegerField()
+    # typed copies of [value] filled at ingest so that dates and measurements can be compared by the database
+    time_point = models.DateTimeField(null=True, blank=True)
+    measurement = models.FloatField(null=True, blank=True)
 
     class Meta:
         ordering = ['uuid']
         verbose_name = 'Value'
         verbose_name_plural = 'Values'
+        indexes = [
+            # values of a message looked up by dimension and storagenr (measurement at a time point's storagenr,
+            # due date of a message, dimension of a message), which are not soft deleted
+            models.Index(fields=['message', 'dimension', 'storagenr'], name='value_msg_dim_storagenr_idx',
+                         condition=models.Q(is_deleted=False)),
+            # only the few time point values of every message, ordered by date for the latest time point lookups
+            models.Index(fields=['dimension', '-time_point', 'message'], name='value_time_point_idx',
+                         condition=models.Q(time_point__isnull=False, is_deleted=False)),
+            # soft deleted values past their retention, for the purge_deleted command
+            models.Index(fields=['deleted_at'], name='value_deleted_idx', condition=models.Q(is_deleted=True)),
+        ]
+
+    def parse_value(self):
+        """parse_value
+            fills the typed columns from the raw value, the time point for the time point dimensions
+            and the measurement for any other dimension
+        """
+        if self.dimension in TIME_POINT_DIMENSIONS:
+            self.time_point, self.measurement = parse_time_point(self.value), None
+        else:
+            self.time_point, self.measurement = None, parse_measurement(self.value)
+
+    def save(self, *args, **kwargs):
+        self.parse_value()
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return str(self.value)
+
+
+class Dimension(models.Model):
+    """Dimension model
+        lookup table interning the dimensions of the values stored in the packed storage mode, whose ids are
+        cached by every process once committed as a dimension never changes. it is not a BaseModel: a dimension
+        is never updated nor soft deleted, and its rows only hold its id and name
+    """
+    name = models.CharField(max_length=50, unique=True)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = 'Dimension'
+        verbose_name_plural = 'Dimensions'
+
+    _ids = {}
+    _names = {}
+
+    @classmethod
+    def get_ids(cls, names):
+        """get_ids
+            interns dimensions, creating the ones which do not exist yet
+            :return dict(name: id): the ids of the dimensions [names]
+        """
+        names = set(names)
+        ids = {name: cls._ids[name] for name in names if name in cls._ids}
+        missing = names - ids.keys()
+        if missing:
+            cls.objects.bulk_create([cls(name=name) for name in missing], ignore_conflicts=True)
+            found = dict(cls.objects.filter(name__in=missing).values_list('name', 'id'))
+            cls._remember(found)
+            ids.update(found)
+        return ids
+
+    @classmethod
+    def get_names(cls, ids):
+        """:return dict(id: name): the names of the dimensions with the [ids]"""
+        ids = set(ids)
+        names = {id: cls._names[id] for id in ids if id in cls._names}
+        missing = ids - names.keys()
+        if missing:
+            found = dict(cls.objects.filter(id__in=missing).values_list('name', 'id'))
+            cls._remember(found)
+            names.update((id, name) for name, id in found.items())
+        return names
+
+    @classmethod
+    def _remember(cls, ids):
+        # dimensions created by a transaction which is rolled back must not be cached
+        def remember():
+            cls._ids.update(ids)
+            cls._names.update((id, name) for name, id in ids.items())
+
+        transaction.on_commit(remember)
+
+    def __str__(self):
+        return self.name
+
+
+class DeviceLatestTelemetry(BaseModel):
+    """DeviceLatestTelemetry model
+        Latest state of a device kept up to date whenever a newer message is received,
+        so that the latest telemetry can be read without going through the device's whole history
+    """
+    device = models.OneToOneField("telemetry.Device", on_delete=models.CASCADE, related_name='latest_telemetry')
+    message = models.ForeignKey("telemetry.Message", on_delete=models.CASCADE, related_name='+')
+    latest_date = models.DateTimeField()
+    latest_value = models.CharField(max_length=50, null=True, blank=True)
+    due_date = models.DateTimeField(null=True, blank=True)
+    due_value = models.CharField(max_length=50, null=True, blank=True)
+    dimension = models.CharField(max_length=50)
+
+    class Meta:
+        ordering = ['uuid']
+        verbose_name = 'Device Latest Telemetry'
+        verbose_name_plural = 'Devices Latest Telemetry'
+        indexes = [
+            # devices whose latest state changed after a watermark, for the incremental exports
+            models.Index(fields=['updated_at'], name='latest_telemetry_updated_idx'),
+        ]
+
+    STATE_FIELDS = ['message', 'latest_date', 'latest_value', 'due_date', 'due_value', 'dimension']
+
+    @classmethod
+    def update_from_messages(cls, messages):
+        """update_from_messages
+            updates the latest state of the messages' devices where a message is newer than the stored state
+            :param messages: iterable of tuple(message: message, values: list of the message's values)
+        """
+        candidates = {}
+        for message, values in messages:
+            summary = summarize_values(values)
+            if summary is None:
+                continue
+            candidate = candidates.get(message.device_id)
+            if candidate is None or summary['latest_date'] > candidate.latest_date:
+                candidates[message.device_id] = cls(device_id=message.device_id, message=message, **summary)
+
+        cls.store(candidates, newer_only=True)
+
+    @classmethod
+    def rebuild(cls, device_ids=None):
+        """rebuild
+            recomputes the latest state of devices from their stored messages which are not soft deleted,
+            with set based queries
+            - the latest "Time Point (time & date)" value of every device is found with a single DISTINCT ON query
+              ordered by the typed time point column
+            - the values of those latest messages are then loaded with a single query
+            - the latest packed message of every device is found with a single DISTINCT ON query ordered by
+              the latest time point stored on the messages, and only those are unpacked and summarized
+            - the state of a device left without any message is soft deleted
+
+            :param device_ids: devices to rebuild, all devices if not provided
+            :return int: number of devices whose latest state has been rebuilt
+        """
+        time_points = Value.objects.filter(dimension=TIME_AND_DATE_DIMENSION, time_point__isnull=False,
+                                           message__is_deleted=False)
+        if device_ids is not None:
+            time_points = time_points.filter(message__device_id__in=device_ids)
+        latest_messages = dict(time_points.annotate(device_id=models.F('message__device_id'))
+                               .order_by('device_id', '-time_point')
+                               .distinct('device_id')
+                               .values_list('device_id', 'message_id'))
+
+        values = defaultdict(list)
+        for value in Value.objects.filter(message_id__in=latest_messages.values()).order_by():
+            values[value.message_id].append(value)
+
+        candidates = {}
+        for device_id, message_id in latest_messages.items():
+            summary = summarize_values(values[message_id])
+            if summary is not None:
+                candidates[device_id] = cls(device_id=device_id, message_id=message_id, **summary)
+
+        packed_messages = Message.objects.filter(packed_values__isnull=False, latest_date__isnull=False)
+        if device_ids is not None:
+            packed_messages = packed_messages.filter(device_id__in=device_ids)
+        packed_messages = packed_messages.order_by('device_id', '-latest_date').distinct('device_id') \
+            .only('id', 'device_id', 'packed_values')
+        for message in packed_messages:
+            summary = summarize_values(message.get_values())
+            candidate = candidates.get(message.device_id)
+            if summary is not None and (candidate is None or summary['latest_date'] > candidate.latest_date):
+                candidates[message.device_id] = cls(device_id=message.device_id, message_id=message.id, **summary)
+
+        cls.store(candidates, newer_only=False)
+
+        # every state which has been rebuilt points to a stored message, the remaining ones have no message left
+        stale = cls.objects.filter(message__is_deleted=True)
+        if device_ids is not None:
+            stale = stale.filter(device_id__in=device_ids)
+        stale.soft_delete()
+        return len(candidates)
+
+    @classmethod
+    def store(cls, candidates, newer_only):
+        """store
+            creates or updates the latest state of devices with a single upsert on the device, so that concurrent
+            transactions storing the state of a device wait for each other instead of one of them being dropped.
+            a soft deleted state is always replaced, and restored.
+            :param candidates: dict(device_id: unsaved latest state of the device)
+            :param newer_only: only replace a stored state which is not soft deleted when the candidate is newer than it
+        """
+        if not candidates:
+            return
+
+        table = cls._meta.db_table
+        state_fields = [cls._meta.get_field(field) for field in cls.STATE_FIELDS]
+        state_columns = [field.column for field in state_fields]
+        columns = ['uuid', 'created_at', 'updated_at', 'is_deleted', 'device_id'] + state_columns
+        updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in state_columns + ['updated_at'])
+        condition = f'WHERE {table}.is_deleted OR EXCLUDED.latest_date > {table}.latest_date' if newer_only else ''
+
+        now = timezone.now()
+        # in the order of the devices, so that concurrent upserts lock the rows of their devices in the same order
+        rows = [[uuid.uuid4(), now, now, False, device_id]
+                + [getattr(candidate, field.attname) for field in state_fields]
+                for device_id, candidate in sorted(candidates.items())]
+        placeholders = ', '.join(['(' + ', '.join(['%s'] * len(columns)) + ')'] * len(rows))
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                INSERT INTO {table} ({', '.join(columns)}) VALUES {placeholders}
+                ON CONFLICT (device_id) DO UPDATE SET {updates}, is_deleted = false, deleted_at = NULL {condition}
+            """, [value for row in rows for value in row])
+
+    def __str__(self):
+        return str(self.device)
+
+
+class QueuedMessage(BaseModel):
+    """QueuedMessage model
+        Gateway payload accepted by the API and journaled in the ingest queue, waiting to be stored
+        by the process_ingest_queue workers. processed payloads are removed from the queue,
+        payloads which could not be stored are kept as failed until they are replayed
+    """
+    PENDING = 'pending'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (FAILED, 'Failed'),
+    ]
+
+    payload = JSONField()
+    # Idempotency-Key header the payload was sent with, identifying its message instead of its content
+    idempotency_key = models.TextField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = 'Queued Message'
+        verbose_name_plural = 'Queued Messages'
+        indexes = [
+            models.Index(fields=['status', 'id'], name='queuedmessage_status_idx'),
+        ]
+
+    @classmethod
+    def stats(cls):
+        """stats
+            backpressure metrics of the ingest queue
+            :return dict(pending: int, failed: int, oldest_pending_age: float seconds or None)
+        """
+        counts = dict(cls.objects.order_by().values_list('status').annotate(count=models.Count('id')))
+        oldest = cls.objects.filter(status=cls.PENDING).order_by('id').values_list('created_at', flat=True).first()
+        return {
+            'pending': counts.get(cls.PENDING, 0),
+            'failed': counts.get(cls.FAILED, 0),
+            'oldest_pending_age': (timezone.now() - oldest).total_seconds() if oldest else None,
+        }
+
+    def __str__(self):
+        return f'{self.uuid} ({self.status})'
+
+
+class ConsumptionRollup(BaseModel):
+    """ConsumptionRollup
+        abstract rollup of the readings of a device over a period, maintained at ingest so that the consumption
+        history of a device is read from a row per period instead of from its values
+        - first and last are the earliest and latest readings of the period by date of the reading
+        - delta is the consumption over the period, from the first to the last reading
+    """
+    device = models.ForeignKey("telemetry.Device", on_delete=models.CASCADE, related_name='+')
+    # first day of the period
+    period = models.DateField()
+    readings = models.PositiveIntegerField(default=0)
+    first_date = models.DateTimeField(null=True, blank=True)
+    first_value = models.FloatField(null=True, blank=True)
+    last_date = models.DateTimeField(null=True, blank=True)
+    last_value = models.FloatField(null=True, blank=True)
+    min_value = models.FloatField(null=True, blank=True)
+    max_value = models.FloatField(null=True, blank=True)
+    delta = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+    STATS_FIELDS = ['readings', 'first_date', 'first_value', 'last_date', 'last_value', 'min_value', 'max_value',
+                    'delta']
+    # length of the period set by the rollups, 'day' or 'month', the date of a reading being truncated to it
+    period_trunc = None
+
+    @classmethod
+    def update_from_readings(cls, readings):
+        """update_from_readings
+            adds readings to the rollups of their devices' periods
+            - the missing rollups are inserted first, conflicts with the ones created concurrently being ignored
+            - the rollups are then locked and merged with the readings, so that no concurrent reading is lost
+
+            :param readings: iterable of tuple(device_id, date: datetime, measurement: float)
+        """
+        periods = defaultdict(list)
+        for device_id, date, measurement in readings:
+            period = timezone.localtime(date).date()
+            if cls.period_trunc == 'month':
+                period = period.replace(day=1)
+            periods[(device_id, period)].append((date, measurement))
+        if not periods:
+            return
+
+        cls.objects.bulk_create([cls(device_id=device_id, period=period) for device_id, period in periods],
+                                ignore_conflicts=True)
+
+        lookup = models.Q()
+        for device_id, period in periods:
+            lookup |= models.Q(device_id=device_id, period=period)
+        rollups = list(cls.objects.select_for_update().filter(lookup).order_by('device_id', 'period'))
+
+        for rollup in rollups:
+            for date, measurement in periods[(rollup.device_id, rollup.period)]:
+                rollup.add(date, measurement)
+        cls.objects.bulk_update(rollups, cls.STATS_FIELDS)
+
+    def add(self, date, measurement):
+        self.readings += 1
+        if self.first_date is None or date < self.first_date:
+            self.first_date, self.first_value = date, measurement
+        if self.last_date is None or date >= self.last_date:
+            self.last_date, self.last_value = date, measurement
+        self.min_value = measurement if self.min_value is None else min(self.min_value, measurement)
+        self.max_value = measurement if self.max_value is None else max(self.max_value, measurement)
+        self.delta = self.last_value - self.first_value
+
+    def __str__(self):
+        return f'{self.device} {self.period}'
+
+
+class DailyConsumption(ConsumptionRollup):
+    """DailyConsumption model
+        rollup of the readings of a device per day
+    """
+
+    class Meta:
+        ordering = ['uuid']
+        verbose_name = 'Daily Consumption'
+        verbose_name_plural = 'Daily Consumptions'
+        unique_together = [['device', 'period']]
+
+    period_trunc = 'day'
+
+
+class MonthlyConsumption(ConsumptionRollup):
+    """MonthlyConsumption model
+        rollup of the readings of a device per month, whose period is the first day of the month
+    """
+
+    class Meta:
+        ordering = ['uuid']
+        verbose_name = 'Monthly Consumption'
+        verbose_name_plural = 'Monthly Consumptions'
+        unique_together = [['device', 'period']]
+
+    period_trunc = 'month'
+
+
+ROLLUPS = [DailyConsumption, MonthlyConsumption]
+
+
+def get_device_readings(device_ids):
+    """:return list of tuple(device_id, date, measurement): the readings of the stored messages of the devices"""
+    readings = []
+
+    values = Value.objects.filter(message__device_id__in=device_ids, message__is_deleted=False) \
+        .annotate(device_id=models.F('message__device_id')).only('message_id', 'value', 'dimension', 'storagenr') \
+        .order_by('message_id')
+    for (device_id, message_id), message_values in groupby(values.iterator(chunk_size=10000),
+                                                           key=lambda value: (value.device_id, value.message_id)):
+        reading = get_reading(message_values)
+        if reading is not None:
+            readings.append((device_id, *reading))
+
+    packed = Message.objects.filter(device_id__in=device_ids, packed_values__isnull=False) \
+        .only('id', 'device_id', 'packed_values').order_by()
+    for message in packed.iterator():
+        reading = get_reading(message.get_values())
+        if reading is not None:
+            readings.append((message.device_id, *reading))
+
+    return readings
+
+
+def rebuild_rollups(device_ids):
+    """rebuild_rollups
+        recomputes the daily and monthly consumption rollups of the devices from their stored messages
+        :return int: number of readings the rollups have been rebuilt from
+    """
+    readings = get_device_readings(device_ids)
+    for rollup in ROLLUPS:
+        rollup.objects.filter(device_id__in=device_ids).delete()
+        rollup.update_from_readings(readings)
+    return len(readings)
+
+
+def refresh_devices(device_ids):
+    """refresh_devices
+        rebuilds the latest state and the consumption rollups of the devices whose messages have been deleted,
+        which would otherwise still include them, and invalidates their exports
+    """
+    device_ids = list(set(device_ids))
+    if not device_ids:
+        return
+
+    DeviceLatestTelemetry.rebuild(device_ids)
+    rebuild_rollups(device_ids)
+    export_cache.invalidate(Device.all_objects.filter(id__in=device_ids).values_list('identnr', flat=True))
@@ -0,0 +1,9 @@
+from rest_framework.pagination import CursorPagination
+
+
+class MessageCursorPagination(CursorPagination):
+    """keyset pagination of the messages from the most recent ones, which is stable while messages are received"""
+    ordering = '-created_at'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -0,0 +1,31 @@
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class ORJSONRenderer(JSONRenderer):
+    """ORJSONRenderer
+        renders JSON with orjson, producing the same bytes as the JSONRenderer in its default compact,
+        unicode configuration for the payload shapes of the API, whose numbers are integers. floats are
+        written in their shortest form without a + in the exponent and non finite floats as null.
+        indented output (browsable API, `indent` media type parameter) and data orjson cannot encode
+        are rendered by the JSONRenderer.
+    """
+    options = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        if not (self.compact and self.ensure_ascii is False and self.encoder_class is JSONEncoder) \
+                or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # the line and paragraph separators are escaped like the JSONRenderer does for javascript
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
@@ -1,13 +1,25 @@
+import copy
 import logging
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 
+from django.conf import settings
+from django.db import IntegrityError, connection, models, transaction
 from rest_framework import serializers
 
-from telemetry.models import Value, Device, Message
+from telemetry.cache import device_cache, export_cache
+from telemetry.models import (
+    Value, Device, Message, DeviceLatestTelemetry, Dimension, ROLLUPS, get_dominant_dimension, get_ingest_key,
+    get_reading
+)
 
 
 logger = logging.getLogger('api')
 
+# maximum number of rows sent to the database in a single INSERT when bulk creating
+BULK_CREATE_BATCH_SIZE = 1000
+# number of times the messages are inserted when retransmissions stored concurrently conflict with them
+INGEST_ATTEMPTS = 3
+
 
 class ValueSerializer(serializers.ModelSerializer):
     """Value serializer"""
@@ -24,8 +36,8 @@ class DeviceSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         # return device if already exits with the same [identnr] else create it device in database
-        # to avoid duplicate devices with the same id
-        device, created = Device.objects.get_or_create(identnr=validated_data['identnr'])
+        # to avoid duplicate devices with the same id, soft deleted devices included
+        device, created = Device.all_objects.get_or_create(identnr=validated_data['identnr'])
 
         if created:
             device.device_type = validated_data['type']
@@ -43,6 +55,198 @@ class DeviceSerializer(serializers.ModelSerializer):
             'type', 'status', 'identnr', 'version', 'accessnr',
             'manufacturer'
         ]
+        # payloads of existing devices are valid, the device is resolved by its [identnr] when creating
+        extra_kwargs = {'identnr': {'validators': []}}
+
+
+def resolve_devices(validated_data_list, use_cache=True):
+    """resolve_devices
+        returns the devices of a list of validated gateway payloads, creating the ones that do not exist yet
+        - known devices are resolved from the device cache without any query, unless [use_cache] is False
+        - the other devices are resolved with a single lookup on their [identnr], soft deleted ones included
+        - the missing devices are bulk created from the first payload received for each of them
+
+        :return tuple(devices: dict(identnr: device), cached: set of the identnrs resolved from the device cache)
+    """
+    # return devices if already exits with the same [identnr] to avoid duplicate devices with the same id.
+    # the messages of a soft deleted device are still stored, the device staying deleted
+    identnrs = {data['device']['identnr'] for data in validated_data_list}
+    devices = device_cache.get_many(identnrs) if use_cache else {}
+    cached = set(devices)
+    missing = identnrs - devices.keys()
+    if missing:
+        devices.update((device.identnr, device) for device in Device.all_objects.filter(identnr__in=missing))
+
+    # create the missing devices from the first payload received for each of them
+    new_devices = {}
+    for data in validated_data_list:
+        device_data = data['device']
+        if device_data['identnr'] not in devices and device_data['identnr'] not in new_devices:
+            new_devices[device_data['identnr']] = Device(
+                identnr=device_data['identnr'],
+                device_type=device_data['type'],
+                status=device_data['status'],
+                version=device_data['version'],
+                accessnr=device_data['accessnr'],
+                manufacturer=device_data['manufacturer']
+            )
+
+    if new_devices:
+        # insert the devices that are still missing and read them back, along with the ones which may have been
+        # created concurrently by another request, so that a device is never duplicated
+        Device.objects.bulk_create(new_devices.values(), batch_size=BULK_CREATE_BATCH_SIZE, ignore_conflicts=True)
+        devices.update((device.identnr, device) for device in Device.all_objects.filter(identnr__in=new_devices))
+
+        for identnr in new_devices:
+            logger.info(f"Device with ID: {identnr} has been created")
+
+    if missing:
+        device_cache.set_many(devices[identnr] for identnr in missing)
+
+    return devices, cached
+
+
+def check_deferred_constraints():
+    """checks the deferred foreign keys of the rows written so far in the current transaction, raising an
+    IntegrityError now instead of when the transaction is committed"""
+    with connection.cursor() as cursor:
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE; SET CONSTRAINTS ALL DEFERRED')
+
+
+def create_telemetry_messages(validated_data_list):
+    """create_telemetry_messages
+        bulk creates the messages for a list of validated gateway payloads, possibly for many devices
+        - resolves all devices with a single lookup on their [identnr], see resolve_devices
+        - bulk creates the devices that do not exist yet
+        - bulk inserts the messages and then all of their values, or only the messages holding their values
+          in the packed storage mode (TELEMETRY_PACKED_VALUES)
+        - updates the latest state and the daily and monthly consumption rollups of the devices
+
+        - stores the retransmissions of a message once, by their ingest key (see get_ingest_key), a payload
+          with an `idempotency_key` being identified by it instead of by its content
+        - a cached device may have been deleted by another process, whose device cache is the only one
+          invalidated: the messages of cached devices are checked against their devices right away, the devices
+          being evicted from the cache and looked up again when one of them is gone
+
+        :return messages: list of the messages in the order of the payloads, the message stored for its first
+         transmission being returned with a `duplicate` attribute for a retransmission
+    """
+    if not validated_data_list:
+        return []
+
+    devices, cached = resolve_devices(validated_data_list)
+
+    packed = settings.TELEMETRY_PACKED_VALUES
+    if packed:
+        dimension_ids = Dimension.get_ids(value['dimension'] for data in validated_data_list for value in data['data'])
+
+    keys = [get_ingest_key(data['device']['identnr'], data['data'], data.get('idempotency_key'))
+            for data in validated_data_list]
+    for attempt in range(INGEST_ATTEMPTS):
+        # retransmissions of stored messages, soft deleted ones included, are found with a single lookup on the
+        # unique ingest key
+        originals = {message.ingest_key: message
+                     for message in Message.all_objects.select_related('device').filter(ingest_key__in=set(keys))}
+        new_data = {}
+        for key, data in zip(keys, validated_data_list):
+            if key not in originals:
+                new_data.setdefault(key, data)
+
+        try:
+            with transaction.atomic():
+                messages = Message.objects.bulk_create(
+                    [Message(device=devices[data['device']['identnr']], ingest_key=key,
+                             dimension=get_dominant_dimension(value['dimension'] for value in data['data']),
+                             packed_values=Message.pack_values(data['data'], dimension_ids) if packed else None,
+                             latest_date=Message.get_latest_date(data['data']) if packed else None)
+                     for key, data in new_data.items()],
+                    batch_size=BULK_CREATE_BATCH_SIZE
+                )
+                if cached:
+                    check_deferred_constraints()
+            break
+        except IntegrityError:
+            # some of the messages have been stored concurrently by a retransmission, they are looked up again,
+            # or some of the cached devices have been deleted, they are looked up again in the database
+            if attempt == INGEST_ATTEMPTS - 1:
+                raise
+            for identnr in cached:
+                device_cache.invalidate(identnr)
+            if cached:
+                devices, cached = resolve_devices(validated_data_list, use_cache=False)
+
+    values = [[Value(message=message, **value) for value in data['data']]
+              for message, data in zip(messages, new_data.values())]
+    for message_values in values:
+        for value in message_values:
+            value.parse_value()
+
+    # write all of the messages' values in batched inserts, unless they are packed in the messages
+    if not packed:
+        Value.objects.bulk_create([value for message_values in values for value in message_values],
+                                  batch_size=BULK_CREATE_BATCH_SIZE)
+
+    # keep the latest state of the devices up to date with the newer messages
+    DeviceLatestTelemetry.update_from_messages(zip(messages, values))
+    # and the rollups of their consumption history
+    readings = []
+    for message, message_values in zip(messages, values):
+        reading = get_reading(message_values)
+        if reading is not None:
+            readings.append((message.device_id, *reading))
+    for rollup in ROLLUPS:
+        rollup.update_from_readings(readings)
+    # the cached exports of the devices which received a message are outdated once it is committed
+    export_cache.invalidate(message.device.identnr for message in messages)
+
+    for message in messages:
+        logger.info(f"Telemetry Message for Device with ID: {message.device.identnr} has been created")
+
+    # retransmissions get the message stored for their first transmission, flagged as a duplicate
+    stored = dict(zip(new_data, messages))
+    results = []
+    for key in keys:
+        if key in stored:
+            results.append(stored.pop(key))
+            originals[key] = results[-1]
+            continue
+        duplicate = copy.copy(originals[key])
+        duplicate.duplicate = True
+        logger.info(f"Telemetry Message for Device with ID: {duplicate.device.identnr} is a retransmission")
+        results.append(duplicate)
+
+    return results
+
+
+class DeviceTelemetryListSerializer(serializers.ListSerializer):
+    """Telemetry list serializer for creating many messages at once and representing a page of messages"""
+
+    @transaction.atomic
+    def create(self, validated_data):
+        return create_telemetry_messages(validated_data)
+
+    def to_representation(self, data):
+        """reads the values of all the messages with a single query returning plain rows, which are turned into
+        the representation of the values without instantiating any model or serializer per value.
+        packed values are unpacked from the messages without any query."""
+        messages = list(data.all() if isinstance(data, models.Manager) else data)
+        fields = ValueSerializer.Meta.fields
+
+        values_data = defaultdict(list)
+        packed = [message for message in messages if message.packed_values is not None]
+        if packed:
+            dimension_names = Dimension.get_names(value[3] for message in packed for value in message.packed_values)
+            for message in packed:
+                values_data[message.id] = message.unpack_values(dimension_names)
+
+        unpacked_ids = [message.id for message in messages if message.packed_values is None]
+        if unpacked_ids:
+            rows = Value.objects.filter(message_id__in=unpacked_ids) \
+                .order_by('message_id', 'storagenr', 'id').values_list('message_id', *fields)
+            for message_id, *row in rows:
+                values_data[message_id].append(dict(zip(fields, row)))
+
+        return [self.child.represent(message, values_data[message.id]) for message in messages]
 
 
 class DeviceTelemetrySerializer(serializers.ModelSerializer):
@@ -50,30 +254,9 @@ class DeviceTelemetrySerializer(serializers.ModelSerializer):
     data = ValueSerializer(write_only=True, many=True)
     device = DeviceSerializer(write_only=True)
 
+    @transaction.atomic
     def create(self, validated_data):
-        device_data = validated_data['device']
-        values_data = validated_data['data']
-
-        # return device if already exits with the same [identnr] else create it device in database
-        device, created = Device.objects.get_or_create(identnr=device_data['identnr'])
-
-        # if created then update it other values from the default values
-        if created:
-            device.device_type = device_data['type']
-            device.status = device_data['status']
-            device.version = device_data['version']
-            device.accessnr = device_data['accessnr']
-            device.manufacturer = device_data['manufacturer']
-            device.save()
-
-            logger.info(f"Device with ID: {device.identnr} has been created")
-
-        message = Message.objects.create(device=device)
-
-        for value in values_data:
-            Value.objects.create(message=message, **value)
-
-        logger.info(f"Telemetry Message for Device with ID: {device.identnr} has been created")
+        message, = create_telemetry_messages([validated_data])
 
         return message
 
@@ -82,23 +265,32 @@ class DeviceTelemetrySerializer(serializers.ModelSerializer):
         fields = [
             'data', 'device'
         ]
+        list_serializer_class = DeviceTelemetryListSerializer
 
     def to_representation(self, instance):
+        if instance.packed_values is not None:
+            dimension_names = Dimension.get_names(value[3] for value in instance.packed_values)
+            return self.represent(instance, instance.unpack_values(dimension_names))
+
+        fields = ValueSerializer.Meta.fields
+        # sorted in memory so that the values prefetched with the message are used
+        values = sorted(instance.data.all(), key=lambda value: (value.storagenr, value.id))
+        return self.represent(instance, [{field: getattr(value, field) for field in fields} for value in values])
+
+    @staticmethod
+    def represent(instance, values_data):
+        """builds the representation of a message from the representation of its values"""
         representation = OrderedDict()
-
-        values_data = []
-        for value in instance.data.order_by('storagenr').iterator():
-            value_serializer = ValueSerializer(instance=value)
-            values_data.append(value_serializer.data)
+        device = instance.device
 
         representation['data'] = values_data
         representation['device'] = {
-            'type': instance.device.device_type,
-            'status': instance.device.status,
-            'identnr': instance.device.identnr,
-            'version': instance.device.version,
-            'accessnr': instance.device.accessnr,
-            'manufacturer': instance.device.manufacturer
+            'type': device.device_type,
+            'status': device.status,
+            'identnr': device.identnr,
+            'version': device.version,
+            'accessnr': device.accessnr,
+            'manufacturer': device.manufacturer
         }
 
         return representation
@@ -125,17 +317,17 @@ class DeviceLatestTelemetryCVSSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         representation = OrderedDict()
-        msg, latest_value, latest_date = instance.get_latest_device_message_and_date()
-        due_value, due_date = instance.get_latest_message_due_date_and_due_date_measurement()
-        representation['date_and_time_of_message'] = latest_date.strftime("%d %B, %Y %H:%M:%S")
+        # read the device's latest state maintained at ingest instead of going through its message history
+        latest = instance.latest_telemetry
+        representation['date_and_time_of_message'] = latest.latest_date.strftime("%d %B, %Y %H:%M:%S")
         representation['device_id'] = instance.identnr
         representation['device_manufacturer'] = instance.manufacturer
         representation['device_type'] = instance.device_type
         representation['device_version'] = instance.version
-        representation['dimension_of_measurement'] = msg.get_dimension()
-        representation['value_of_newest_measurement'] = latest_value
-        representation['value_of_measurement_in_due_date'] = due_value
-        representation['date_of_due_date'] = due_date.strftime("%d %B, %Y")
+        representation['dimension_of_measurement'] = latest.dimension
+        representation['value_of_newest_measurement'] = latest.latest_value
+        representation['value_of_measurement_in_due_date'] = latest.due_value
+        representation['date_of_due_date'] = latest.due_date.strftime("%d %B, %Y") if latest.due_date else None
 
         logger.info("producing csv data | Date and time of Message: {date_and_time_of_message} | DeviceID: {"
                     "device_id} | Device Manufacturer: {device_manufacturer} | Device Type: {device_type} | "
@@ -145,3 +337,16 @@ class DeviceLatestTelemetryCVSSerializer(serializers.ModelSerializer):
                     "Date of Due Date: {date_of_due_date} |".format(**representation))
 
         return representation
+
+
+class ConsumptionSerializer(serializers.Serializer):
+    """Consumption serializer for the daily and monthly consumption history of a device"""
+    period = serializers.DateField()
+    readings = serializers.IntegerField()
+    first_date = serializers.DateTimeField()
+    first_value = serializers.FloatField()
+    last_date = serializers.DateTimeField()
+    last_value = serializers.FloatField()
+    min_value = serializers.FloatField()
+    max_value = serializers.FloatField()
+    delta = serializers.FloatField()
@@ -0,0 +1,13 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from telemetry.cache import device_cache, export_cache
+from telemetry.models import Device
+
+
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+def invalidate_cached_device(sender, instance, **kwargs):
+    """drops a device from the device cache and invalidates its exports whenever it is changed or deleted"""
+    device_cache.invalidate(instance.identnr)
+    export_cache.invalidate([instance.identnr])
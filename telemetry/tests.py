@@ -1,6 +1,55 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime
+from io import BytesIO, StringIO
 
-from telemetry.models import Device
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.core.asgi import get_asgi_application
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.http import QueryDict
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from telemetry.asgi import TelemetryIngestApplication
+from telemetry.cache import DeviceCache, ExportCache, device_cache
+from telemetry.loadtest import compare, generate_payloads
+from telemetry.metrics import RequestMetrics, request_metrics
+from telemetry.models import (
+    ConsumptionRollup, DailyConsumption, Device, DeviceLatestTelemetry, Dimension, Message, MonthlyConsumption,
+    QueuedMessage, Value
+)
+from telemetry.parsers import ORJSONParser
+from telemetry.renderers import ORJSONRenderer
+from telemetry.serializers import DeviceTelemetrySerializer
+
+
+def build_payload(identnr, storage_records=1, date="2020-07-01T12:00:00.000000", due_date="2020-06-30T00:00:00.000000"):
+    """builds a gateway payload in the shape accepted by DeviceTelemetrySerializer"""
+    data = []
+    for storagenr in range(storage_records):
+        data.append({'value': str(1000 + storagenr), 'tariff': 0, 'subunit': 0,
+                     'dimension': 'Energy (Wh)', 'storagenr': storagenr})
+        data.append({'value': date if storagenr == 0 else due_date, 'tariff': 0, 'subunit': 0,
+                     'dimension': 'Time Point (time & date)' if storagenr == 0 else 'Time Point (date)',
+                     'storagenr': storagenr})
+    return {
+        'data': data,
+        'device': {'type': 7, 'status': 0, 'identnr': identnr, 'version': 112, 'accessnr': 34,
+                   'manufacturer': 11298},
+    }
 
 
 class DeviceModelTest(TestCase):
@@ -16,3 +65,936 @@ class DeviceModelTest(TestCase):
         num_of_devices = Device.objects.count()
 
         self.assertEqual(num_of_devices, 3, msg=f'expected: {3} got: {num_of_devices}')
+
+
+class DeviceTelemetrySerializerTest(TestCase):
+    """Test DeviceTelemetrySerializer ingestion"""
+
+    def ingest(self, payload):
+        serializer = DeviceTelemetrySerializer(data=payload)
+        serializer.is_valid(raise_exception=True)
+        with CaptureQueriesContext(connection) as context:
+            message = serializer.save()
+        return message, len(context.captured_queries)
+
+    def test_create_stores_all_values(self):
+        message, _ = self.ingest(build_payload(69656545, storage_records=15))
+
+        self.assertEqual(Message.objects.count(), 1)
+        self.assertEqual(Value.objects.filter(message=message).count(), 30)
+
+    def test_create_fills_typed_columns(self):
+        message, _ = self.ingest(build_payload(69656545, storage_records=2))
+
+        time_point = message.data.get(dimension='Time Point (time & date)')
+        measurement = message.data.get(dimension='Energy (Wh)', storagenr=1)
+
+        self.assertEqual(time_point.time_point.strftime("%Y-%m-%d %H:%M"), "2020-07-01 12:00")
+        self.assertIsNone(time_point.measurement)
+        self.assertEqual(measurement.measurement, 1001)
+        self.assertIsNone(measurement.time_point)
+
+    def test_create_stores_most_common_dimension(self):
+        message, _ = self.ingest(build_payload(69656545, storage_records=3))
+
+        self.assertEqual(message.dimension, 'Energy (Wh)')
+
+        Message.objects.filter(pk=message.pk).update(dimension=None)
+        message = Message.objects.get(pk=message.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(message.get_dimension(), 'Energy (Wh)')
+
+    def test_create_query_count_is_constant(self):
+        # warm up with the device so both payloads below take the same (existing device) path, with another
+        # message of the same time so that neither is a retransmission nor newer than it
+        self.ingest(build_payload(69656545, storage_records=2))
+
+        _, small = self.ingest(build_payload(69656545, storage_records=1))
+        _, large = self.ingest(build_payload(69656545, storage_records=15))
+
+        self.assertEqual(small, large, msg=f'expected: {small} queries got: {large}')
+
+
+class DeviceTelemetryBatchTest(APITestCase):
+    """Test batch ingestion of many gateway payloads"""
+
+    url = '/v1/api/device_message/batch/'
+
+    def test_batch_creates_messages_for_many_devices(self):
+        Device.objects.create(identnr=69656545)
+        payloads = [build_payload(69656545), build_payload(67756545), build_payload(67756545, storage_records=3)]
+
+        response = self.client.post(self.url, payloads, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([item['status'] for item in response.data], [201, 201, 201])
+        self.assertEqual(Device.objects.count(), 2)
+        self.assertEqual(Message.objects.filter(device__identnr=67756545).count(), 2)
+        self.assertEqual(Value.objects.count(), 2 + 2 + 6)
+
+    def test_batch_reports_invalid_items(self):
+        invalid = build_payload(69656545)
+        del invalid['device']
+
+        response = self.client.post(self.url, [build_payload(67756545), invalid], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data[0]['status'], status.HTTP_201_CREATED)
+        self.assertEqual(response.data[1]['status'], status.HTTP_400_BAD_REQUEST)
+        self.assertIn('device', response.data[1]['errors'])
+        self.assertEqual(Message.objects.count(), 1)
+
+
+class ImportTelemetryCommandTest(TestCase):
+    """Test the import_telemetry management command"""
+
+    def setUp(self) -> None:
+        directory = tempfile.mkdtemp()
+        self.path = os.path.join(directory, 'telemetry.jsonl')
+        with open(self.path, 'w') as f:
+            for identnr in (69656545, 67756545, 69653345):
+                f.write(json.dumps(build_payload(identnr)) + '\n')
+            f.write('not json\n')
+
+    def test_import_and_resume(self):
+        call_command('import_telemetry', self.path, batch_size=2, stdout=StringIO(), stderr=StringIO())
+
+        self.assertEqual(Message.objects.count(), 3)
+        self.assertEqual(open(f'{self.path}.checkpoint').read(), f'{os.path.getsize(self.path)} 4')
+
+        # nothing is imported twice when resuming from a checkpoint at the end of the file
+        call_command('import_telemetry', self.path, stdout=StringIO(), stderr=StringIO())
+
+        self.assertEqual(Message.objects.count(), 3)
+
+    def test_skipped_lines_are_reported(self):
+        # resumed after the first two lines
+        with open(self.path, 'rb') as f:
+            offset = len(f.readline()) + len(f.readline())
+        with open(f'{self.path}.checkpoint', 'w') as f:
+            f.write(f'{offset} 2')
+        stdout, stderr = StringIO(), StringIO()
+
+        call_command('import_telemetry', self.path, stdout=stdout, stderr=stderr)
+
+        self.assertIn('Skipping line 4: invalid JSON', stderr.getvalue())
+        self.assertIn('1 messages imported, 1 skipped', stdout.getvalue())
+
+
+# cache shared between processes, through which the export cache is enabled
+SHARED_CACHE = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': os.path.join(tempfile.gettempdir(), 'metr-test-cache')}
+
+
+@override_settings(CACHES={'default': SHARED_CACHE})
+class DeviceLatestTelemetryTest(APITransactionTestCase):
+    """Test the latest telemetry maintained at ingest and its CSV export"""
+
+    url = '/v1/api/telemetry_cvs/'
+
+    def setUp(self) -> None:
+        # the exports are only invalidated once messages are committed, so each test starts from an empty cache
+        caches['default'].clear()
+
+    def tearDown(self) -> None:
+        device_cache.clear()
+
+    def ingest(self, payload):
+        serializer = DeviceTelemetrySerializer(data=payload)
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    def test_latest_telemetry_follows_newest_message(self):
+        newest = self.ingest(build_payload(69656545, storage_records=2, date="2020-07-02T08:30:00.000000"))
+        self.ingest(build_payload(69656545, storage_records=2, date="2020-07-01T12:00:00.000000"))
+
+        latest = DeviceLatestTelemetry.objects.get(device__identnr=69656545)
+
+        self.assertEqual(latest.message, newest)
+        self.assertEqual(latest.latest_date.strftime("%Y-%m-%d %H:%M"), "2020-07-02 08:30")
+        self.assertEqual(latest.due_date.strftime("%Y-%m-%d"), "2020-06-30")
+
+    def test_concurrent_states_keep_the_newest(self):
+        device = Device.objects.create(identnr=69656545)
+        older, newer = [Message.objects.create(device=device) for _ in range(2)]
+
+        def candidate(message, day):
+            return DeviceLatestTelemetry(device=device, message=message, dimension='Energy (Wh)',
+                                         latest_date=datetime(2020, 7, day, tzinfo=timezone.utc))
+
+        def store_newer():
+            try:
+                with transaction.atomic():
+                    DeviceLatestTelemetry.store({device.id: candidate(newer, 2)}, newer_only=True)
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            DeviceLatestTelemetry.store({device.id: candidate(older, 1)}, newer_only=True)
+            # the newer state is stored by another transaction which waits until this one is committed
+            thread = threading.Thread(target=store_newer)
+            thread.start()
+            thread.join(0.2)
+        thread.join()
+        self.assertEqual(DeviceLatestTelemetry.objects.get().message, newer)
+
+        # a soft deleted state is replaced by the next one
+        DeviceLatestTelemetry.objects.get().soft_delete()
+        DeviceLatestTelemetry.store({device.id: candidate(older, 1)}, newer_only=True)
+        self.assertEqual(DeviceLatestTelemetry.objects.get().message, older)
+
+    def test_csv_export(self):
+        self.ingest(build_payload(69656545, storage_records=2))
+        Device.objects.create(identnr=67756545)
+
+        response = self.client.get(self.url, {'format': 'csv'})
+        rows = response.content.decode().splitlines()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(rows), 2)
+        self.assertIn('01 July, 2020 12:00:00', rows[1])
+        self.assertIn('30 June, 2020', rows[1])
+
+    def test_csv_export_query_count_is_constant(self):
+        self.ingest(build_payload(69656545, storage_records=2))
+        with self.assertNumQueries(1):
+            self.client.get(self.url, {'format': 'csv'})
+
+        for identnr in range(1, 20):
+            self.ingest(build_payload(identnr, storage_records=2))
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'format': 'csv'})
+
+        self.assertEqual(len(response.content.decode().splitlines()), 21)
+
+    def test_csv_export_is_cached_until_ingest(self):
+        self.ingest(build_payload(69656545, storage_records=2))
+        self.ingest(build_payload(67756545, storage_records=2))
+        response = self.client.get(self.url, {'format': 'csv'})
+        device_response = self.client.get(self.url, {'format': 'csv', 'identnr': 67756545})
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url, {'format': 'csv'})
+            not_modified = self.client.get(self.url, {'format': 'csv'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['Content-Type'], response['Content-Type'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.ingest(build_payload(69656545, storage_records=2, date="2020-07-02T08:30:00.000000"))
+
+        # only the exports including the device which received a message are invalidated
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(self.url, {'format': 'csv', 'identnr': 67756545},
+                                           HTTP_IF_NONE_MATCH=device_response['ETag'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        refreshed = self.client.get(self.url, {'format': 'csv'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(refreshed.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(refreshed['ETag'], response['ETag'])
+        self.assertIn('02 July, 2020 08:30:00', refreshed.content.decode())
+
+        for _ in range(2):
+            empty = self.client.get(self.url, {'format': 'csv', 'identnr': 1})
+            self.assertEqual((empty.status_code, empty.content), (status.HTTP_200_OK, b''))
+
+    def test_soft_deleted_devices_leave_the_caches(self):
+        self.ingest(build_payload(69656545, storage_records=2))
+        response = self.client.get(self.url, {'format': 'csv'})
+
+        Device.objects.filter(identnr=69656545).soft_delete()
+
+        refreshed = self.client.get(self.url, {'format': 'csv'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(refreshed.status_code, status.HTTP_200_OK)
+        self.assertNotIn('69656545', refreshed.content.decode())
+        self.assertEqual(device_cache.get_many([69656545]), {})
+
+    def test_soft_deleted_messages_leave_the_latest_telemetry(self):
+        self.ingest(build_payload(69656545, storage_records=2))
+        newest = self.ingest(build_payload(69656545, storage_records=2, date="2020-07-02T08:30:00.000000"))
+        response = self.client.get(self.url, {'format': 'csv'})
+        self.assertIn('02 July, 2020 08:30:00', response.content.decode())
+
+        Message.objects.get(id=newest.id).soft_delete()
+
+        refreshed = self.client.get(self.url, {'format': 'csv'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(refreshed.status_code, status.HTTP_200_OK)
+        self.assertNotIn('02 July, 2020', refreshed.content.decode())
+        self.assertIn('01 July, 2020 12:00:00', refreshed.content.decode())
+        device = Device.objects.get(identnr=69656545)
+        self.assertNotEqual(device.get_latest_device_message_and_date()[0].id, newest.id)
+        self.assertEqual(list(DailyConsumption.objects.values_list('period', 'readings')),
+                         [(datetime(2020, 7, 1).date(), 1)])
+
+        # a device left without any message is no longer exported
+        Message.objects.filter(device=device).soft_delete()
+        self.assertEqual(self.client.get(self.url, {'format': 'csv'}).content, b'')
+        self.assertIsNone(device.get_latest_device_message_and_date())
+        self.assertFalse(MonthlyConsumption.objects.exists())
+
+    @override_settings(CACHES={'default': SHARED_CACHE, 'ingest': SHARED_CACHE,
+                               'local': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_export_cache_is_invalidated_across_processes(self):
+        # the cache instances of the process serving the exports and of a process ingesting messages
+        serving, ingesting = ExportCache('default', 60), ExportCache('ingest', 60)
+        query_params = QueryDict('format=csv&identnr=69656545')
+        tag = serving.get_tag(query_params)
+
+        ingesting.invalidate([69656545])
+
+        self.assertNotEqual(serving.get_tag(query_params), tag)
+        # a local memory cache would not see the versions changed by the other processes
+        self.assertFalse(ExportCache('local', 60).enabled)
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.ingest(build_payload(69656545, storage_records=2))
+            response = self.client.get(self.url, {'format': 'csv'})
+        self.assertNotIn('ETag', response)
+
+    @override_settings(TELEMETRY_EXPORT_WATERMARK_LAG=0)
+    def test_incremental_csv_export(self):
+        self.ingest(build_payload(69656545, storage_records=2))
+        self.ingest(build_payload(67756545, storage_records=2))
+        watermark = self.client.get(self.url, {'format': 'csv'})['X-Watermark']
+
+        self.ingest(build_payload(67756545, storage_records=2, date="2020-07-02T08:30:00.000000"))
+        # an older reading does not change the latest telemetry of the device
+        self.ingest(build_payload(69656545, storage_records=2, date="2020-06-30T08:30:00.000000"))
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'format': 'csv', 'cursor': watermark})
+        rows = response.content.decode().splitlines()
+        self.assertEqual(len(rows), 2)
+        self.assertIn('67756545', rows[1])
+        self.assertIn('02 July, 2020 08:30:00', rows[1])
+
+        response = self.client.get(self.url, {'format': 'csv', 'cursor': response['X-Watermark']})
+        self.assertEqual(response.content, b'')
+
+        response = self.client.get(self.url, {'format': 'csv', 'changed_since': '2000-01-01T00:00:00Z'})
+        self.assertEqual(len(response.content.decode().splitlines()), 3)
+
+        response = self.client.get(self.url, {'format': 'csv', 'changed_since': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_latest_telemetry(self):
+        for identnr in (69656545, 67756545, 68856545):
+            self.ingest(build_payload(identnr, storage_records=2))
+        csv_rows = self.client.get(self.url, {'format': 'csv'}).content.decode().splitlines()
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'export.csv.gz')
+            call_command('export_latest_telemetry', output, workers=2, range_size=2, stdout=StringIO())
+            with gzip.open(output, 'rt', newline='') as f:
+                rows = f.read().splitlines()
+
+            # an interrupted export only exports the ranges without a part file when resumed
+            call_command('export_latest_telemetry', output, workers=2, range_size=2, stdout=StringIO())
+            os.makedirs(f'{output}.parts')
+            with open(os.path.join(f'{output}.parts', 'manifest.json'), 'w') as f:
+                json.dump({'format': 'csv', 'ranges': [[0, None]]}, f)
+            call_command('export_latest_telemetry', output, workers=1, resume=True, stdout=StringIO())
+            with gzip.open(output, 'rt', newline='') as f:
+                resumed_rows = f.read().splitlines()
+
+        self.assertEqual(rows[0], csv_rows[0])
+        self.assertEqual(sorted(rows[1:]), sorted(csv_rows[1:]))
+        self.assertEqual(rows, resumed_rows)
+        self.assertFalse(os.path.exists(f'{output}.parts'))
+
+    def test_rebuild_latest_telemetry(self):
+        self.ingest(build_payload(69656545, date="2020-07-01T12:00:00.000000"))
+        newest = self.ingest(build_payload(69656545, date="2020-07-02T08:30:00.000000"))
+        DeviceLatestTelemetry.objects.all().delete()
+
+        call_command('rebuild_latest_telemetry', stdout=StringIO())
+
+        self.assertEqual(DeviceLatestTelemetry.objects.get(device__identnr=69656545).message, newest)
+
+    def test_streamed_csv_export_matches_csv_export(self):
+        for identnr in (69656545, 67756545):
+            self.ingest(build_payload(identnr, storage_records=2))
+
+        response = self.client.get(self.url, {'format': 'csv'})
+        streamed = self.client.get(self.url, {'format': 'csv', 'stream': 'true'})
+
+        self.assertTrue(streamed.streaming)
+        self.assertEqual(b''.join(streamed.streaming_content), response.content)
+
+
+class TelemetryPartitionsCommandTest(TestCase):
+    """Test the telemetry_partitions management command"""
+
+    def partition_of_values(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT DISTINCT tableoid::regclass::text FROM telemetry_value')
+            return [name for name, in cursor.fetchall()]
+
+    def test_rows_are_moved_out_of_the_default_partition(self):
+        serializer = DeviceTelemetrySerializer(data=build_payload(69656545))
+        serializer.is_valid(raise_exception=True)
+        message = serializer.save()
+
+        self.assertEqual(self.partition_of_values(), ['telemetry_value_default'])
+
+        call_command('telemetry_partitions', months_ahead=1, stdout=StringIO())
+
+        month = message.created_at
+        self.assertEqual(self.partition_of_values(), [f'telemetry_value_y{month.year}m{month.month:02d}'])
+        self.assertEqual(message.data.count(), 2)
+
+    def test_old_partitions_are_dropped(self):
+        call_command('telemetry_partitions', months_ahead=0, stdout=StringIO())
+        call_command('telemetry_partitions', months_ahead=0, detach_before='2999-01', drop=True, stdout=StringIO())
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_class WHERE relname LIKE 'telemetry_value_y%%'")
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_detached_partitions_are_kept(self):
+        device = Device.objects.create(identnr=69656545)
+        message = Message.objects.create(device=device)
+        Value.objects.create(message=message, value='1000', tariff=0, subunit=0, dimension='Energy (Wh)', storagenr=0)
+        Message.objects.update(created_at='2020-01-15T00:00:00Z')
+        Value.objects.update(created_at='2020-01-15T00:00:00Z')
+
+        call_command('telemetry_partitions', months_ahead=0, detach_before='2020-02', stdout=StringIO())
+
+        self.assertFalse(Message.objects.exists())
+        with connection.cursor() as cursor:
+            # the deferred foreign keys are checked as when committing
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            cursor.execute('SELECT count(*) FROM telemetry_value_y2020m01')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_packed_messages_are_kept(self):
+        device = Device.objects.create(identnr=69656545)
+        dimension_ids = Dimension.get_ids(['Energy (Wh)'])
+        packed = Message.objects.create(device=device, packed_values=Message.pack_values(
+            [{'value': '1000', 'tariff': 0, 'subunit': 0, 'dimension': 'Energy (Wh)', 'storagenr': 0}], dimension_ids))
+        Message.objects.create(device=device)
+        Message.objects.update(created_at='2020-01-15T00:00:00Z')
+
+        call_command('telemetry_partitions', months_ahead=0, detach_before='2020-02', drop=True, stdout=StringIO())
+
+        # the message without values is deleted, the packed one holds its values
+        self.assertEqual(list(Message.objects.all()), [packed])
+
+
+class DeviceCacheTest(TransactionTestCase):
+    """Test the device cache used on the ingest path"""
+
+    def tearDown(self) -> None:
+        device_cache.clear()
+
+    def test_least_recently_used_devices_are_evicted(self):
+        cache = DeviceCache(max_size=2)
+        devices = [Device.objects.create(identnr=identnr) for identnr in (1, 2, 3)]
+
+        cache.set_many(devices[:2])
+        cache.get_many([1])
+        cache.set_many(devices[2:])
+
+        self.assertEqual(set(cache.get_many([1, 2, 3])), {1, 3})
+
+    def test_known_devices_are_not_looked_up(self):
+        serializer = DeviceTelemetrySerializer(data=build_payload(69656545))
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        serializer = DeviceTelemetrySerializer(data=build_payload(69656545))
+        serializer.is_valid(raise_exception=True)
+        with CaptureQueriesContext(connection) as context:
+            serializer.save()
+
+        device_queries = [query for query in context.captured_queries if 'FROM "telemetry_device"' in query['sql']]
+        self.assertEqual(device_queries, [])
+        self.assertEqual(Device.objects.count(), 1)
+
+    def test_saved_devices_are_invalidated(self):
+        device = Device.objects.create(identnr=69656545)
+        device_cache.set_many([device])
+
+        device.status = 1
+        device.save()
+
+        self.assertEqual(device_cache.get_many([69656545]), {})
+
+    def test_devices_deleted_by_another_process_are_looked_up_again(self):
+        serializer = DeviceTelemetrySerializer(data=build_payload(69656545))
+        serializer.is_valid(raise_exception=True)
+        deleted = serializer.save().device
+        # deleted by another process, whose device cache is the only one invalidated
+        Device.objects.filter(id=deleted.id).delete()
+        device_cache.set_many([deleted])
+
+        serializer = DeviceTelemetrySerializer(data=build_payload(69656545, date="2020-07-02T12:00:00.000000"))
+        serializer.is_valid(raise_exception=True)
+        message = serializer.save()
+
+        self.assertNotEqual(message.device.id, deleted.id)
+        self.assertEqual(Message.objects.get().device, Device.objects.get(identnr=69656545))
+        self.assertEqual(device_cache.get_many([69656545]), {69656545: message.device})
+
+
+@override_settings(TELEMETRY_ASYNC_INGEST=True)
+class IngestQueueTest(APITestCase):
+    """Test the accept and enqueue ingest mode and the queue workers"""
+
+    url = '/v1/api/device_message/'
+
+    def test_payloads_are_queued_then_stored(self):
+        response = self.client.post(self.url, build_payload(69656545), format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(Message.objects.count(), 0)
+        self.assertEqual(self.client.get(f'{self.url}queue/').data['pending'], 1)
+
+        call_command('process_ingest_queue', stdout=StringIO())
+
+        self.assertEqual(Message.objects.filter(device__identnr=69656545).count(), 1)
+        self.assertEqual(QueuedMessage.objects.count(), 0)
+
+    def test_failed_payloads_can_be_replayed(self):
+        payload = build_payload(69656545)
+        QueuedMessage.objects.create(payload={'data': payload['data']})
+
+        call_command('process_ingest_queue', stdout=StringIO())
+
+        queued = QueuedMessage.objects.get()
+        self.assertEqual((queued.status, queued.attempts), (QueuedMessage.FAILED, 1))
+
+        QueuedMessage.objects.filter(pk=queued.pk).update(payload=payload)
+        call_command('process_ingest_queue', replay=True, stdout=StringIO())
+
+        self.assertEqual(QueuedMessage.objects.count(), 0)
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_idempotency_key_is_queued(self):
+        payload = build_payload(69656545)
+        first = self.client.post(self.url, payload, format='json', HTTP_IDEMPOTENCY_KEY='retry-1')
+        payload['data'][0]['value'] = '2000'
+        retry = self.client.post(self.url, payload, format='json', HTTP_IDEMPOTENCY_KEY='retry-1')
+
+        self.assertEqual([first.status_code, retry.status_code], [status.HTTP_202_ACCEPTED] * 2)
+        call_command('process_ingest_queue', stdout=StringIO())
+        self.assertEqual(Message.objects.count(), 1)
+
+        # once stored, a retransmission is answered with the stored message
+        retry = self.client.post(self.url, payload, format='json', HTTP_IDEMPOTENCY_KEY='retry-1')
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.data['data'][0]['value'], '1000')
+        self.assertEqual(QueuedMessage.objects.count(), 0)
+
+    @override_settings(TELEMETRY_INGEST_QUEUE_MAX_PENDING=1)
+    def test_full_queue_is_refused(self):
+        self.client.post(self.url, build_payload(69656545), format='json')
+        response = self.client.post(self.url, build_payload(69656545), format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    @override_settings(TELEMETRY_INGEST_QUEUE_MAX_PENDING=2)
+    def test_batch_which_does_not_fit_in_the_queue_is_refused(self):
+        self.client.post(self.url, build_payload(69656545), format='json')
+        payloads = [build_payload(identnr) for identnr in (67756545, 69653345)]
+
+        response = self.client.post(f'{self.url}batch/', payloads, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(QueuedMessage.objects.count(), 1)
+
+    def test_batch_retransmissions_are_not_queued(self):
+        stored = build_payload(69656545)
+        self.client.post(self.url, stored, format='json')
+        call_command('process_ingest_queue', stdout=StringIO())
+
+        response = self.client.post(f'{self.url}batch/', [build_payload(67756545), stored], format='json')
+
+        self.assertEqual([result['status'] for result in response.data],
+                         [status.HTTP_202_ACCEPTED, status.HTTP_200_OK])
+        self.assertEqual(response.data[1]['uuid'], Message.objects.get().uuid)
+        self.assertEqual(QueuedMessage.objects.count(), 1)
+
+
+class TelemetryIngestApplicationTest(TransactionTestCase):
+    """Test the asynchronous ingestion endpoint served over ASGI"""
+
+    def setUp(self) -> None:
+        self.application = TelemetryIngestApplication(get_asgi_application())
+
+    def tearDown(self) -> None:
+        device_cache.clear()
+
+    def post(self, *bodies):
+        async def request(body):
+            communicator = ApplicationCommunicator(self.application, {
+                'type': 'http', 'method': 'POST', 'path': '/v1/api/device_message/async/', 'headers': [],
+            })
+            await communicator.send_input({'type': 'http.request', 'body': body})
+            start = await communicator.receive_output(timeout=5)
+            response = await communicator.receive_output(timeout=5)
+            return start['status'], json.loads(response['body'])
+
+        async def requests():
+            return await asyncio.gather(*(request(body) for body in bodies))
+
+        return async_to_sync(requests)()
+
+    def test_concurrent_payloads_are_stored(self):
+        responses = self.post(*(json.dumps(build_payload(identnr)).encode() for identnr in range(1, 6)))
+
+        self.assertEqual([status_code for status_code, data in responses], [201] * 5)
+        self.assertEqual(Message.objects.count(), 5)
+        self.assertEqual(set(str(uuid) for uuid in Message.objects.values_list('uuid', flat=True)),
+                         {data['uuid'] for status_code, data in responses})
+
+    def test_only_payloads_which_cannot_be_stored_fail(self):
+        payloads = [build_payload(identnr) for identnr in range(1, 5)]
+        # valid, but rejected by the database as a new device
+        payloads[1]['device']['type'] = -1
+
+        responses = self.post(*(json.dumps(payload).encode() for payload in payloads))
+
+        self.assertEqual([status_code for status_code, data in responses], [201, 500, 201, 201])
+        self.assertEqual(sorted(Message.objects.values_list('device__identnr', flat=True)), [1, 3, 4])
+
+    def test_invalid_payload_is_rejected(self):
+        [(status_code, data)] = self.post(b'{"data": []}')
+
+        self.assertEqual(status_code, 400)
+        self.assertIn('device', data)
+
+
+class DeviceTelemetryListTest(APITestCase):
+    """Test the paginated and filtered listing of messages"""
+
+    url = '/v1/api/device_message/'
+
+    def setUp(self) -> None:
+        for identnr, date in ((69656545, "2020-07-01T12:00:00.000000"), (69656545, "2020-07-02T12:00:00.000000"),
+                              (67756545, "2020-07-01T12:00:00.000000")):
+            serializer = DeviceTelemetrySerializer(data=build_payload(identnr, storage_records=3, date=date))
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+    def test_messages_are_paginated(self):
+        response = self.client.get(self.url, {'page_size': 2})
+
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual([value['storagenr'] for value in response.data['results'][0]['data']], [0, 0, 1, 1, 2, 2])
+
+        response = self.client.get(response.data['next'])
+
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+
+    def test_messages_are_filtered_by_device(self):
+        response = self.client.get(self.url, {'identnr': 69656545})
+
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual({message['device']['identnr'] for message in response.data['results']}, {69656545})
+
+    def test_page_query_count_is_constant(self):
+        with self.assertNumQueries(2):
+            self.client.get(self.url, {'page_size': 1})
+        with self.assertNumQueries(2):
+            self.client.get(self.url, {'page_size': 3})
+
+    def test_page_representation_matches_message_representation(self):
+        response = self.client.get(self.url)
+
+        for message, data in zip(Message.objects.order_by('-created_at'), response.data['results']):
+            self.assertEqual(DeviceTelemetrySerializer(instance=message).data, data)
+            self.assertEqual(data['data'][0], {'value': '1000', 'tariff': 0, 'subunit': 0,
+                                               'dimension': 'Energy (Wh)', 'storagenr': 0})
+
+
+class ORJSONTest(APITestCase):
+    """Test the orjson renderer and parser against the ones of django rest framework"""
+
+    def test_renderer_output_is_identical(self):
+        for identnr in (69656545, 67756545):
+            serializer = DeviceTelemetrySerializer(data=build_payload(identnr, storage_records=3))
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+        page = self.client.get('/v1/api/device_message/').data
+        page['results'][0]['device']['manufacturer'] = 'Zähler \u2028'
+
+        self.assertEqual(ORJSONRenderer().render(page), JSONRenderer().render(page))
+        self.assertEqual(ORJSONRenderer().render(page, 'application/json; indent=4'),
+                         JSONRenderer().render(page, 'application/json; indent=4'))
+
+    def test_parser_output_is_identical(self):
+        body = json.dumps(build_payload(69656545, storage_records=3)).encode()
+
+        self.assertEqual(ORJSONParser().parse(BytesIO(body)), JSONParser().parse(BytesIO(body)))
+        with self.assertRaises(ParseError):
+            ORJSONParser().parse(BytesIO(b'{"data": NaN}'))
+
+
+class RequestMetricsTest(APITestCase):
+    """Test the request metrics recorded by the middleware"""
+
+    def setUp(self) -> None:
+        request_metrics.clear()
+        serializer = DeviceTelemetrySerializer(data=build_payload(69656545, storage_records=3))
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+    def test_request_metrics(self):
+        with self.assertLogs('api', level='INFO') as logs:
+            response = self.client.get('/v1/api/device_message/')
+
+        self.assertEqual(response['X-DB-Queries'], '2')
+        self.assertIn('serialize;dur=', response['Server-Timing'])
+        self.assertIn('render;dur=', response['Server-Timing'])
+        record = logs.records[-1]
+        self.assertEqual(record.route, 'telemetry:message-list')
+        self.assertGreater(record.serialize_time_ms, 0)
+        self.assertEqual(record.db_queries, 2)
+        self.assertEqual(record.response_bytes, len(response.content))
+
+        metrics = self.client.get('/metrics').content.decode()
+        labels = 'route="telemetry:message-list",method="GET"'
+        self.assertIn(f'telemetry_request_duration_seconds_count{{{labels}}} 1', metrics)
+        self.assertIn(f'telemetry_request_db_queries_bucket{{{labels},le="2"}} 1', metrics)
+        self.assertIn(f'telemetry_request_db_queries_bucket{{{labels},le="1"}} 0', metrics)
+        self.assertIn(f'telemetry_request_response_bytes_total{{{labels}}} {len(response.content)}', metrics)
+        self.assertIn(f'telemetry_request_serialize_seconds_total{{{labels}}} ', metrics)
+        self.assertIn(f'telemetry_request_requests_total{{{labels},status="200"}} 1', metrics)
+
+    def test_large_values_keep_their_precision(self):
+        metrics = RequestMetrics()
+        for _ in range(2):
+            metrics.observe('telemetry:message-list', 'GET', 200, 617283.75, 1, 0.125, 0, 0, 1234567)
+
+        rendered = metrics.render()
+        labels = 'route="telemetry:message-list",method="GET"'
+        self.assertIn(f'telemetry_request_response_bytes_total{{{labels}}} 2469134\n', rendered)
+        self.assertIn(f'telemetry_request_duration_seconds_sum{{{labels}}} 1234567.5\n', rendered)
+        self.assertIn(f'telemetry_request_db_seconds_total{{{labels}}} 0.25\n', rendered)
+
+
+class LoadTestTest(TestCase):
+    """Test the payload generator and the baseline comparison of the load test"""
+
+    def test_generated_payloads_are_valid(self):
+        payloads = list(generate_payloads(devices=3, values=30, history=2))
+
+        self.assertEqual(len(payloads), 6)
+        self.assertEqual(payloads, list(generate_payloads(devices=3, values=30, history=2)))
+        self.assertEqual({len(payload['data']) for payload in payloads}, {30})
+
+        serializer = DeviceTelemetrySerializer(data=payloads, many=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+        latest = DeviceLatestTelemetry.objects.get(device__identnr=payloads[-1]['device']['identnr'])
+        self.assertEqual(latest.latest_date.strftime("%Y-%m-%d %H:%M"), "2020-07-01 12:00")
+        self.assertEqual(latest.due_date.strftime("%Y-%m-%d"), "2020-06-30")
+
+    def test_regressions_are_detected(self):
+        baseline = {'list': {'p95_ms': 100, 'queries_per_request': 2, 'errors': 0}}
+
+        self.assertEqual(compare({'list': {'p95_ms': 120, 'queries_per_request': 2, 'errors': 0}}, baseline, 0.25), [])
+        self.assertEqual(len(compare({'list': {'p95_ms': 130, 'queries_per_request': 3, 'errors': 1}}, baseline,
+                                     0.25)), 3)
+
+
+class PackedValuesTest(APITestCase):
+    """Test the packed storage mode of the values"""
+
+    def ingest(self, payload, idempotency_key=None):
+        serializer = DeviceTelemetrySerializer(data=payload)
+        serializer.is_valid(raise_exception=True)
+        return serializer.save(idempotency_key=idempotency_key)
+
+    def test_packed_messages_are_represented_as_stored_values(self):
+        payload = build_payload(69656545, storage_records=3)
+        payload['data'].reverse()
+        stored = self.ingest(payload, idempotency_key='stored')
+        with override_settings(TELEMETRY_PACKED_VALUES=True):
+            packed = self.ingest(payload, idempotency_key='packed')
+
+        self.assertEqual(Value.objects.filter(message=packed).count(), 0)
+        self.assertEqual(len(packed.packed_values), 6)
+        self.assertEqual(Dimension.objects.count(), 3)
+
+        results = self.client.get('/v1/api/device_message/').data['results']
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(DeviceTelemetrySerializer(instance=Message.objects.get(id=packed.id)).data,
+                         DeviceTelemetrySerializer(instance=Message.objects.get(id=stored.id)).data)
+
+    @override_settings(TELEMETRY_PACKED_VALUES=True)
+    def test_latest_telemetry_of_packed_messages(self):
+        self.ingest(build_payload(69656545, storage_records=2, date="2020-07-02T08:30:00.000000"))
+        self.ingest(build_payload(69656545, storage_records=2, date="2020-07-01T12:00:00.000000"))
+        DeviceLatestTelemetry.objects.all().delete()
+
+        call_command('rebuild_latest_telemetry', stdout=StringIO())
+
+        latest = DeviceLatestTelemetry.objects.get(device__identnr=69656545)
+        self.assertEqual(latest.latest_date.strftime("%Y-%m-%d %H:%M"), "2020-07-02 08:30")
+        self.assertEqual(latest.due_date.strftime("%Y-%m-%d"), "2020-06-30")
+        self.assertEqual(Device.objects.get(identnr=69656545).get_latest_device_message_and_date()[2],
+                         latest.latest_date)
+
+    def test_pack_values(self):
+        messages = [self.ingest(build_payload(identnr, storage_records=3)) for identnr in (69656545, 67756545)]
+        representations = [DeviceTelemetrySerializer(instance=message).data for message in messages]
+
+        call_command('pack_values', batch_size=1, stdout=StringIO())
+
+        self.assertEqual(Value.objects.count(), 0)
+        self.assertEqual({message.latest_date for message in Message.objects.all()},
+                         set(DeviceLatestTelemetry.objects.values_list('latest_date', flat=True)))
+        self.assertEqual([DeviceTelemetrySerializer(instance=Message.objects.get(id=message.id)).data
+                          for message in messages], representations)
+
+
+class ConsumptionHistoryTest(APITestCase):
+    """Test the consumption rollups and the history endpoint"""
+
+    url = '/v1/api/telemetry_history/'
+
+    def setUp(self) -> None:
+        readings = [("2020-06-30T22:00:00.000000", '900'), ("2020-07-01T08:00:00.000000", '1000'),
+                    ("2020-07-01T20:00:00.000000", '1150'), ("2020-07-01T12:00:00.000000", '1100'),
+                    ("2020-07-02T12:00:00.000000", '1200')]
+        for date, value in readings:
+            payload = build_payload(69656545, storage_records=2, date=date)
+            payload['data'][0]['value'] = value
+            serializer = DeviceTelemetrySerializer(data=payload)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+    def test_daily_history(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'identnr': 69656545, 'start': '2020-07-01'})
+
+        self.assertEqual([day['period'] for day in response.data], ['2020-07-01', '2020-07-02'])
+        day = response.data[0]
+        self.assertEqual(day['readings'], 3)
+        self.assertEqual((day['first_value'], day['last_value']), (1000, 1150))
+        self.assertEqual((day['min_value'], day['max_value'], day['delta']), (1000, 1150, 150))
+
+    def test_monthly_history(self):
+        response = self.client.get(self.url, {'identnr': 69656545, 'period': 'month'})
+
+        self.assertEqual([(month['period'], month['readings'], month['delta']) for month in response.data],
+                         [('2020-06-01', 1, 0), ('2020-07-01', 4, 200)])
+
+    def test_history_requires_a_device(self):
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'identnr': 69656545, 'period': 'year'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_rebuild_rollups(self):
+        expected = list(MonthlyConsumption.objects.order_by('period').values(*ConsumptionRollup.STATS_FIELDS))
+        MonthlyConsumption.objects.all().delete()
+        DailyConsumption.objects.all().delete()
+
+        call_command('rebuild_rollups', stdout=StringIO())
+
+        self.assertEqual(list(MonthlyConsumption.objects.order_by('period').values(*ConsumptionRollup.STATS_FIELDS)),
+                         expected)
+        self.assertEqual(DailyConsumption.objects.count(), 3)
+
+
+class IdempotentIngestTest(APITestCase):
+    """Test the deduplication of retransmitted messages"""
+
+    url = '/v1/api/device_message/'
+
+    def test_retransmissions_get_the_original_message(self):
+        payload = build_payload(69656545, storage_records=2)
+        first = self.client.post(self.url, payload, format='json')
+        retransmission = self.client.post(self.url, payload, format='json')
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retransmission.status_code, status.HTTP_200_OK)
+        self.assertEqual(retransmission.data, first.data)
+        self.assertEqual(Message.objects.count(), 1)
+        self.assertEqual(Value.objects.count(), 4)
+
+        response = self.client.post(f'{self.url}batch/', [payload, build_payload(67756545), build_payload(67756545)],
+                                    format='json')
+        self.assertEqual([item['status'] for item in response.data], [200, 201, 200])
+        self.assertEqual(response.data[1]['uuid'], response.data[2]['uuid'])
+        self.assertEqual(Message.objects.count(), 2)
+        self.assertEqual(DailyConsumption.objects.get(device__identnr=69656545).readings, 1)
+
+    def test_idempotency_key(self):
+        payload = build_payload(69656545)
+        first = self.client.post(self.url, payload, format='json', HTTP_IDEMPOTENCY_KEY='retry-1')
+        second = self.client.post(self.url, payload, format='json', HTTP_IDEMPOTENCY_KEY='retry-2')
+        payload['data'][0]['value'] = '2000'
+        retransmission = self.client.post(self.url, payload, format='json', HTTP_IDEMPOTENCY_KEY='retry-1')
+
+        self.assertEqual([first.status_code, second.status_code, retransmission.status_code],
+                         [status.HTTP_201_CREATED, status.HTTP_201_CREATED, status.HTTP_200_OK])
+        self.assertEqual(Message.objects.count(), 2)
+
+    def test_collapse_duplicates(self):
+        payload = build_payload(69656545, storage_records=2)
+        for _ in range(3):
+            self.client.post(self.url, payload, format='json')
+            Message.objects.update(ingest_key=None)
+        self.client.post(self.url, build_payload(69656545, date="2020-07-02T08:30:00.000000"), format='json')
+        Message.objects.update(ingest_key=None)
+        original = Message.objects.order_by('id').first()
+
+        call_command('collapse_duplicates', batch_size=2, stdout=StringIO())
+
+        self.assertEqual(Message.objects.count(), 2)
+        self.assertTrue(Message.objects.filter(id=original.id).exists())
+        self.assertEqual(Value.objects.filter(message=original).count(), 4)
+        self.assertEqual(DailyConsumption.objects.get(device__identnr=69656545, period='2020-07-01').readings, 1)
+        self.assertEqual(self.client.post(self.url, payload, format='json').status_code, status.HTTP_200_OK)
+
+
+class SoftDeleteTest(APITestCase):
+    """Test the default managers leaving out the soft deleted rows and their purge"""
+
+    url = '/v1/api/device_message/'
+
+    def setUp(self) -> None:
+        for identnr, date in ((69656545, "2020-07-01T12:00:00.000000"), (69656545, "2020-07-02T12:00:00.000000"),
+                              (67756545, "2020-07-01T12:00:00.000000")):
+            self.client.post(self.url, build_payload(identnr, date=date), format='json')
+        self.earlier, self.latest, self.other = Message.objects.order_by('id').values_list('uuid', flat=True)
+
+    def test_soft_deleted_rows_are_left_out(self):
+        Message.objects.get(uuid=self.latest).soft_delete()
+        Device.objects.get(identnr=67756545).soft_delete()
+
+        self.assertEqual(Message.objects.count(), 2)
+        self.assertEqual(Message.all_objects.count(), 3)
+        self.assertEqual(Device.objects.count(), 1)
+        self.assertEqual(Device.objects.get().messages.count(), 1)
+        self.assertEqual(len(self.client.get(self.url).data['results']), 1)
+
+        self.assertEqual(Value.objects.filter(message__uuid=self.earlier).soft_delete(), 2)
+        self.assertEqual(Value.objects.filter(message__uuid=self.earlier).count(), 0)
+
+        # the messages of a soft deleted device are still stored, and a retransmission is still recognized
+        response = self.client.post(self.url, build_payload(67756545, date="2020-07-03T12:00:00.000000"),
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(self.url, build_payload(69656545, date="2020-07-02T12:00:00.000000"),
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Device.all_objects.count(), 2)
+
+    def test_purge_deleted(self):
+        Message.objects.filter(uuid=self.latest).soft_delete()
+        Device.objects.filter(identnr=67756545).soft_delete()
+        Message.all_objects.update(deleted_at='2020-01-01T00:00:00Z')
+        Device.all_objects.update(deleted_at='2020-01-01T00:00:00Z')
+        # soft deleted within the retention period
+        Value.objects.filter(message__uuid=self.earlier, storagenr=0, dimension='Energy (Wh)').soft_delete()
+
+        call_command('purge_deleted', batch_size=1, stdout=StringIO())
+
+        self.assertEqual(list(Message.all_objects.values_list('uuid', flat=True)), [self.earlier])
+        self.assertEqual(Value.all_objects.count(), 2)
+        self.assertEqual(list(Device.all_objects.values_list('identnr', flat=True)), [69656545])
+        # the latest state of the device moved to its remaining message
+        self.assertEqual(DeviceLatestTelemetry.objects.get().message.uuid, self.earlier)
+        self.assertFalse(DailyConsumption.objects.filter(device__identnr=67756545).exists())
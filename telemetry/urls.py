@@ -1,11 +1,12 @@
 from django.urls import path, include
 from rest_framework import routers
 
-from telemetry.api import DeviceTelemetryViewSet, LatestTelemetryCVSViewSet
+from telemetry.api import ConsumptionHistoryViewSet, DeviceTelemetryViewSet, LatestTelemetryCVSViewSet
 
 router = routers.DefaultRouter()
 router.register('device_message', DeviceTelemetryViewSet)
 router.register('telemetry_cvs', LatestTelemetryCVSViewSet)
+router.register('telemetry_history', ConsumptionHistoryViewSet, basename='consumption-history')
 
 app_name = 'telemetry'
 urlpatterns = [
@@ -1,3 +1,10 @@
-from django.shortcuts import render
+from django.http import HttpResponse
 
-# Create your views here.
+from telemetry.metrics import request_metrics
+
+
+def metrics(request):
+    """metrics
+        serves the request metrics of this process in the Prometheus text exposition format
+    """
+    return HttpResponse(request_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')